@@ -5,11 +5,16 @@ import asyncio
 import logging
 import os
 import pickle
+import sqlite3
+import time
 
-from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 from hashlib import sha256
 from urllib.parse import urlparse
-from typing import Dict, Iterator, List, Generic, Optional, Type, TypeVar
+from typing import (Any, Awaitable, Callable, Dict, Iterator, List, Generic, Mapping, Optional,
+                    Set, Tuple, Type, TypeVar)
 
 import aiohttp
 import aioftp
@@ -23,6 +28,9 @@ logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
 ITEM = TypeVar('ITEM')
 
+#: Marks the end of items in `AsyncPipeline` queue
+_END_OF_ITEMS = object()
+
 class EndProcessing(BaseException):
     """Raised by `AsyncFilter` to tell `AsyncPipeline` to stop processing"""
 
@@ -49,10 +57,126 @@ class EndProcessingItem(Exception):
         return self.__class__.__name__
 
 
+class StageMetrics():
+    """Throughput, queue depth and latency of one pipeline stage
+
+    Arguments:
+      name: name of the stage
+    """
+
+    #: upper bounds (in seconds) of the latency histogram buckets
+    BUCKETS = (0.01, 0.1, 1, 10, 100, float('inf'))
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        #: number of items queued for this stage
+        self.waiting = 0
+        #: maximum number of items waiting at any time
+        self.max_waiting = 0
+        #: number of items being processed
+        self.active = 0
+        #: number of items by outcome (passed, dropped, failed)
+        self.outcomes: Counter = Counter()
+        #: number of items by latency bucket
+        self.histogram = [0] * len(self.BUCKETS)
+        #: total seconds spent processing items
+        self.busy_time = 0.0
+        #: total seconds items spent queued
+        self.wait_time = 0.0
+        self._first_start: Optional[float] = None
+        self._last_end: Optional[float] = None
+
+    def enqueue(self) -> None:
+        """Records an item being queued for this stage"""
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+
+    def start(self, waited: float) -> float:
+        """Records an item leaving the queue after **waited** seconds"""
+        now = time.monotonic()
+        self.waiting -= 1
+        self.wait_time += waited
+        self.active += 1
+        if self._first_start is None:
+            self._first_start = now
+        return now
+
+    def finish(self, outcome: str, latency: float) -> None:
+        """Records an item finishing with **outcome** after **latency** seconds"""
+        self.active -= 1
+        self.outcomes[outcome] += 1
+        self.busy_time += latency
+        self._last_end = time.monotonic()
+        for idx, bound in enumerate(self.BUCKETS):
+            if latency < bound:
+                self.histogram[idx] += 1
+                break
+
+    @property
+    def processed(self) -> int:
+        """Number of items processed"""
+        return sum(self.outcomes.values())
+
+    @property
+    def throughput(self) -> float:
+        """Items processed per second (while the stage was active)"""
+        if not self.processed or self._first_start is None:
+            return 0.0
+        elapsed = self._last_end - self._first_start
+        return self.processed / elapsed if elapsed > 0 else float('inf')
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Returns metrics as dict"""
+        return {
+            'stage': self.name,
+            'processed': self.processed,
+            'throughput': self.throughput,
+            'max_waiting': self.max_waiting,
+            'busy_time': self.busy_time,
+            'wait_time': self.wait_time,
+            'latency_histogram': {
+                '<{}s'.format(bound): count
+                for bound, count in zip(self.BUCKETS, self.histogram)
+            },
+            **self.outcomes
+        }
+
+    def __str__(self) -> str:
+        histogram = " ".join("<{}s:{}".format(bound, count)
+                             for bound, count in zip(self.BUCKETS, self.histogram)
+                             if count)
+        return ("{}: {} items ({:.1f}/s), {} passed, {} dropped, {} failed, "
+                "max queue {}, waited {:.1f}s, latency {}".format(
+                    self.name, self.processed, self.throughput,
+                    self.outcomes["passed"], self.outcomes["dropped"],
+                    self.outcomes["failed"], self.max_waiting,
+                    self.wait_time, histogram or "-"))
+
+
 class AsyncFilter(abc.ABC, Generic[ITEM]):
-    """Function object type called by Scanner"""
+    """Function object type called by Scanner
+
+    Subclasses may set **max_concurrency** to limit the number of items
+    this filter processes concurrently. Such filters are run by their own
+    pool of **max_concurrency** workers fed through a queue. Items waiting
+    in the queue or being processed by the workers do not count towards
+    the pipeline's **max_inflight**, so other items keep passing through
+    the remaining filters.
+    """
+
+    #: maximum number of items processed concurrently (None for no limit)
+    max_concurrency: Optional[int] = None
+
     def __init__(self, pipeline: "AsyncPipeline", *_args, **_kwargs) -> None:
         self.pipeline = pipeline
+        #: metrics for this filter
+        self.metrics = StageMetrics(self.__class__.__name__)
+        #: queue feeding the workers if **max_concurrency** is set (created by pipeline)
+        self.queue: Optional[asyncio.Queue] = None
+
+    def set_max_concurrency(self, limit: Optional[int]) -> None:
+        """Limits number of items processed concurrently to **limit**"""
+        self.max_concurrency = limit
 
     @abc.abstractmethod
     async def apply(self, recipe: ITEM) -> ITEM:
@@ -65,42 +189,84 @@ class AsyncFilter(abc.ABC, Generic[ITEM]):
         """Called at the end of a run"""
 
 
+def default_io_workers() -> int:
+    """Default number of threads for `AsyncPipeline.run_io`"""
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def default_proc_workers() -> int:
+    """Default number of processes for `AsyncPipeline.run_sp`"""
+    return os.cpu_count() or 1
+
+
 class AsyncPipeline(Generic[ITEM]):
-    """Processes items in an asyncio pipeline"""
+    """Processes items in an asyncio pipeline
+
+    Arguments:
+      max_inflight: number of items processed concurrently (not counting
+                    items queued for or in filters with **max_concurrency**)
+      io_workers: number of threads for `run_io` (default: number of CPUs + 4, at most 32)
+      proc_workers: number of processes for `run_sp` (default: number of CPUs)
+    """
 
-    def __init__(self, max_inflight: int = 100) -> None:
+    def __init__(self, max_inflight: int = 100, io_workers: Optional[int] = None,
+                 proc_workers: Optional[int] = None) -> None:
         try:  # get or create loop (threads don't have one)
             #: our asyncio loop
             self.loop = asyncio.get_event_loop()
         except RuntimeError:
             self.loop = asyncio.new_event_loop()
             asyncio.set_event_loop(self.loop)
-        #: semaphore to limit io parallelism
-        self.io_sem: asyncio.Semaphore = asyncio.Semaphore(1)
         #: must never run more than one conda at the same time
         self.conda_sem: asyncio.Semaphore = asyncio.Semaphore(1)
         #: the filters successively applied to each item
         self.filters: List[AsyncFilter] = []
+        #: executor running blocking io in threads
+        self.io_pool_executor = ThreadPoolExecutor(io_workers or default_io_workers())
         #: executor running things in separate python processes
-        self.proc_pool_executor = ProcessPoolExecutor(3)
-        #: semaphore limiting the number of items processed concurrently
-        self.limit_inflight = asyncio.Semaphore(max_inflight)
+        self.proc_pool_executor = ProcessPoolExecutor(proc_workers or default_proc_workers())
+        #: number of items processed concurrently
+        self.max_inflight = max_inflight
+        #: slots for items being processed (created in `_async_run`)
+        self._inflight: Optional[asyncio.Semaphore] = None
+        #: number of items (if known, for progress display)
+        self.num_items: Optional[int] = None
 
     def add(self, filt: Type[AsyncFilter[ITEM]], *args, **kwargs) -> None:
         """Adds `Filter` to this `Scanner`"""
         self.filters.append(filt(self, *args, **kwargs))
 
+    def set_max_concurrency(self, name: str, limit: Optional[int]) -> None:
+        """Sets concurrency **limit** for filters of class **name**
+
+        A **limit** of None removes the limit.
+        """
+        if limit is not None and limit < 1:
+            raise ValueError("Concurrency limit must be at least 1")
+        filters = [filt for filt in self.filters if filt.__class__.__name__ == name]
+        if not filters:
+            raise ValueError("No filter {} in pipeline".format(name))
+        for filt in filters:
+            filt.set_max_concurrency(limit)
+
+    def get_metrics(self) -> List[Dict[str, Any]]:
+        """Returns metrics for each filter (stage) in pipeline order"""
+        return [filt.metrics.as_dict() for filt in self.filters]
+
+    def log_metrics(self) -> None:
+        """Logs summary of stage metrics"""
+        logger.info("Stage metrics:")
+        for filt in self.filters:
+            logger.info("  %s", filt.metrics)
+
     def run(self) -> bool:
         """Enters the asyncio loop and manages shutdown."""
+        task = asyncio.ensure_future(self._async_run())
         try:
-            task = asyncio.ensure_future(self._async_run())
             self.loop.run_until_complete(task)
             logger.warning("Finished update")
-        except (KeyboardInterrupt, EndProcessing) as exc:
-            if isinstance(exc, KeyboardInterrupt):
-                logger.error("Ctrl-C pressed - aborting...")
-            if isinstance(exc, EndProcessing):
-                logger.error("Terminating...")
+        except KeyboardInterrupt:
+            logger.error("Ctrl-C pressed - aborting...")
             task.cancel()
             try:
                 self.loop.run_until_complete(task)
@@ -109,57 +275,666 @@ class AsyncPipeline(Generic[ITEM]):
 
         for filt in self.filters:
             filt.finalize()
+        self.log_metrics()
         return task.result()
 
     @abc.abstractmethod
     def get_item_iterator(self) -> Iterator[ITEM]:
-        """Load items"""
+        """Load items
+
+        Items are consumed lazily as processing capacity becomes available.
+        """
 
     async def _async_run(self) -> bool:
-        """Runner within async loop"""
+        """Runner within async loop
+
+        Each item from `get_item_iterator` is processed in its own task,
+        started once one of **max_inflight** slots is free, so items are
+        loaded only as processing capacity becomes available. Filters
+        with **max_concurrency** set are run by separate worker pools
+        (see `apply_filter`). If a filter raises `EndProcessing`, all
+        tasks are cancelled and no further items are loaded.
+        """
         await asyncio.gather(*(filt.async_init() for filt in self.filters))
-        coros = [
-            asyncio.ensure_future(
-                self.process(item)
-            )
-            for item in self.get_item_iterator()
-        ]
+        self._inflight = asyncio.Semaphore(self.max_inflight)
+        results: List[bool] = []
+        stopping = False
+        ended = False
+        running: Set[asyncio.Future] = set()
+        finished: List[asyncio.Future] = []
+
+        def item_done(task):
+            running.discard(task)
+            finished.append(task)
+
+        async def process_item(item, progress):
+            nonlocal ended
+            try:
+                result = await self.process(item)
+            except EndProcessing:
+                ended = True
+                return
+            finally:
+                self._inflight.release()
+            if not stopping:
+                results.append(result)
+                progress.update(1)
+
+        def check_finished():
+            while finished:
+                finished.pop().result()
+
+        workers = []
+        for filt in self.filters:
+            if filt.max_concurrency:
+                filt.queue = asyncio.Queue(self.max_inflight)
+                workers.extend(asyncio.ensure_future(self._stage_worker(filt))
+                               for _ in range(filt.max_concurrency))
+
+        with tqdm(total=self.num_items) as progress:
+            try:
+                items = iter(self.get_item_iterator())
+                while not ended:
+                    await self._inflight.acquire()
+                    check_finished()
+                    item = next(items, _END_OF_ITEMS)
+                    if item is _END_OF_ITEMS or ended:
+                        self._inflight.release()
+                        break
+                    task = asyncio.ensure_future(process_item(item, progress))
+                    running.add(task)
+                    task.add_done_callback(item_done)
+                while running and not ended:
+                    await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    check_finished()
+                check_finished()
+                if ended:
+                    logger.error("Terminating...")
+            except asyncio.CancelledError:
+                return False
+            finally:
+                # tasks check the flag in case they swallowed the cancel
+                stopping = True
+                tasks = list(running) + workers
+                for task in tasks:
+                    task.cancel()
+                if tasks:
+                    await asyncio.wait(tasks)
+                for filt in self.filters:
+                    filt.queue = None
+        return all(results)
+
+    async def process(self, item: ITEM) -> bool:
+        """Applies the filters to an item"""
         try:
-            with tqdm(asyncio.as_completed(coros),
-                      total=len(coros)) as tcoros:
-                return all([await coro for coro in tcoros])
+            for filt in self.filters:
+                item = await self.apply_filter(filt, item)
         except asyncio.CancelledError:
-            for coro in coros:
-                coro.cancel()
-            await asyncio.wait(coros)
             return False
+        except EndProcessingItem as item_error:
+            item_error.log(logger)
+            raise
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("While processing %s", item)
+            return False
+        return True
 
-    async def process(self, item: ITEM) -> bool:
-        """Applies the filters to an item"""
-        async with self.limit_inflight:
+    async def apply_filter(self, filt: AsyncFilter[ITEM], item: ITEM) -> ITEM:
+        """Applies **filt** to **item** within its concurrency limit
+
+        Filters without limit are applied directly. Otherwise, the item
+        is handed to the filter's workers and the inflight slot held by
+        the item is released until the workers are done with it, so that
+        items queued for a slow filter don't block other items.
+        """
+        metrics = filt.metrics
+        metrics.enqueue()
+        if filt.queue is None:
+            return await self._apply_filter(filt, item, metrics.start(0.0))
+        future = self.loop.create_future()
+        try:
+            await filt.queue.put((item, future, time.monotonic()))
+        except BaseException:
+            metrics.waiting -= 1
+            raise
+        self._inflight.release()
+        try:
+            return await future
+        finally:
+            await self._inflight.acquire()
+
+    async def _stage_worker(self, filt: AsyncFilter[ITEM]) -> None:
+        """Applies **filt** to items from its queue"""
+        while True:
+            item, future, queued = await filt.queue.get()
+            started = filt.metrics.start(time.monotonic() - queued)
+            if future.done():  # caller was cancelled
+                filt.metrics.finish("failed", 0.0)
+                continue
             try:
-                for filt in self.filters:
-                    item = await filt.apply(item)
+                result = await self._apply_filter(filt, item, started)
             except asyncio.CancelledError:
-                return False
-            except EndProcessingItem as item_error:
-                item_error.log(logger)
                 raise
-            except Exception:  # pylint: disable=broad-except
-                logger.exception("While processing %s", item)
-                return False
-        return True
+            except BaseException as exc:  # pylint: disable=broad-except
+                if not future.done():
+                    future.set_exception(exc)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    @staticmethod
+    async def _apply_filter(filt: AsyncFilter[ITEM], item: ITEM, started: float) -> ITEM:
+        """Applies **filt** recording latency and outcome in its metrics"""
+        outcome = "failed"
+        try:
+            item = await filt.apply(item)
+            outcome = "passed"
+            return item
+        except EndProcessingItem:
+            outcome = "dropped"
+            raise
+        finally:
+            filt.metrics.finish(outcome, time.monotonic() - started)
 
     async def run_io(self, func, *args):
-        """Run **func** in thread pool executor using **args**"""
-        async with self.io_sem:
-            return await self.loop.run_in_executor(None, func, *args)
+        """Run **func** in thread pool executor using **args**
+
+        Calls run concurrently; **func** must be thread safe.
+        """
+        return await self.loop.run_in_executor(self.io_pool_executor, func, *args)
 
     async def run_sp(self, func, *args):
         """Run **func** in process pool executor using **args**"""
         return await self.loop.run_in_executor(self.proc_pool_executor, func, *args)
 
 
+#: Fraction of the time since Last-Modified for which a response without
+#: explicit expiry is considered fresh (RFC 7234, section 4.2.2)
+HEURISTIC_FRESHNESS_FRACTION = 0.1
+
+#: Upper limit for heuristic freshness in seconds
+HEURISTIC_FRESHNESS_MAX = 24 * 60 * 60
+
+
+def _parse_http_date(value: Optional[str]) -> Optional[float]:
+    """Parses HTTP date header **value** into a timestamp"""
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    """Parses Cache-Control header **value** into dict of directives"""
+    directives: Dict[str, Optional[str]] = {}
+    for part in (value or "").split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') or None
+    return directives
+
+
+def is_storable(headers: Mapping[str, str]) -> bool:
+    """Checks whether a response with **headers** may be stored"""
+    return "no-store" not in _parse_cache_control(headers.get("Cache-Control"))
+
+
+def freshness_lifetime(headers: Mapping[str, str], now: float) -> float:
+    """Computes seconds a response may be used without revalidation
+
+    Follows RFC 7234 (section 4.2) for a private cache: ``max-age`` takes
+    precedence over ``Expires``. Without either, a heuristic based on
+    ``Last-Modified`` is used. The ``Age`` of the response is deducted.
+    """
+    cache_control = _parse_cache_control(headers.get("Cache-Control"))
+    if "no-cache" in cache_control or "no-store" in cache_control:
+        return 0
+    date = _parse_http_date(headers.get("Date")) or now
+    if "max-age" in cache_control:
+        try:
+            lifetime = float(cache_control["max-age"])
+        except (TypeError, ValueError):
+            lifetime = 0
+    elif "Expires" in headers:
+        # invalid dates (e.g. "0") mean "already expired"
+        expires = _parse_http_date(headers.get("Expires"))
+        lifetime = expires - date if expires else 0
+    else:
+        last_modified = _parse_http_date(headers.get("Last-Modified"))
+        if last_modified:
+            lifetime = min(HEURISTIC_FRESHNESS_MAX,
+                           (date - last_modified) * HEURISTIC_FRESHNESS_FRACTION)
+        else:
+            lifetime = 0
+    try:
+        age = float(headers.get("Age", 0))
+    except ValueError:
+        age = 0
+    return max(0, lifetime - age)
+
+
+class HttpCacheEntry():
+    """Cached response text together with its validators
+
+    Arguments:
+      text: the response body
+      headers: the response headers
+      now: time the request was made
+    """
+    __slots__ = ['text', 'etag', 'last_modified', 'expires']
+
+    def __init__(self, text: str, headers: Mapping[str, str], now: float) -> None:
+        #: the response body
+        self.text = text
+        #: ETag validator (if provided by server)
+        self.etag: Optional[str] = None
+        #: Last-Modified validator (if provided by server)
+        self.last_modified: Optional[str] = None
+        #: timestamp after which the entry must be revalidated
+        self.expires: float = 0
+        self.update(headers, now)
+
+    def update(self, headers: Mapping[str, str], now: float) -> None:
+        """Updates validators and expiry from (304) response **headers**"""
+        self.etag = headers.get("ETag", self.etag)
+        self.last_modified = headers.get("Last-Modified", self.last_modified)
+        self.expires = now + freshness_lifetime(headers, now)
+
+    def is_fresh(self, now: float) -> bool:
+        """Checks whether entry can be used without revalidation"""
+        return now < self.expires
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Returns headers making a GET conditional on entry being stale"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class CacheStore():
+    """Persistent key-value store backed by SQLite
+
+    Each entry is committed as it is written, so that a crash or Ctrl-C
+    loses nothing and memory use does not grow with the size of the cache.
+    Entries may carry a TTL after which they are dropped. If **max_size** is
+    given, the least recently used entries are evicted once the stored values
+    exceed that many bytes.
+
+    Arguments:
+      fname: path to the database file
+      max_size: maximum total size of the stored values in bytes
+    """
+
+    #: evict entries after this many writes (in addition to on open and close)
+    EVICT_INTERVAL = 1000
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        namespace TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value BLOB NOT NULL,
+        expires REAL,
+        accessed REAL NOT NULL,
+        PRIMARY KEY (namespace, key)
+    )"""
+
+    def __init__(self, fname: str, max_size: Optional[int] = None) -> None:
+        self.fname = fname
+        self.max_size = max_size
+        #: database connection (only exists while open)
+        self.conn: Optional[sqlite3.Connection] = None
+        self._writes = 0
+
+    def __enter__(self) -> 'CacheStore':
+        self.open()
+        return self
+
+    def __exit__(self, _ext_type, _exc, _trace) -> None:
+        self.close()
+
+    def _connect(self) -> None:
+        self.conn = sqlite3.connect(self.fname, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(self.SCHEMA)
+
+    def open(self) -> None:
+        """Opens (or creates) the database"""
+        cache_dir = os.path.dirname(self.fname)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        try:
+            self._connect()
+        except sqlite3.DatabaseError:
+            logger.warning("Replacing unreadable cache %s", self.fname)
+            if self.conn:
+                self.conn.close()
+            os.remove(self.fname)
+            self._connect()
+        self.expire()
+        self.evict()
+
+    def close(self) -> None:
+        """Evicts excess entries and closes the database"""
+        if self.conn:
+            self.evict()
+            self.conn.close()
+            self.conn = None
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        """Returns value stored for **key** in **namespace**"""
+        row = self.conn.execute(
+            "SELECT value, expires FROM entries WHERE namespace=? AND key=?",
+            (namespace, key)).fetchone()
+        if row is None:
+            return default
+        value, expires = row
+        now = time.time()
+        if expires is not None and expires <= now:
+            self.delete(namespace, key)
+            return default
+        self.conn.execute(
+            "UPDATE entries SET accessed=? WHERE namespace=? AND key=?",
+            (now, namespace, key))
+        return pickle.loads(value)
+
+    def set(self, namespace: str, key: str, value: Any,
+            ttl: Optional[float] = None) -> None:
+        """Stores **value** for **key** in **namespace**
+
+        The entry expires after **ttl** seconds, if given.
+        """
+        now = time.time()
+        expires = now + ttl if ttl is not None else None
+        self.conn.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+            (namespace, key, pickle.dumps(value), expires, now))
+        self._writes += 1
+        if self._writes % self.EVICT_INTERVAL == 0:
+            self.evict()
+
+    def delete(self, namespace: str, key: str) -> None:
+        """Removes **key** from **namespace**"""
+        self.conn.execute("DELETE FROM entries WHERE namespace=? AND key=?",
+                          (namespace, key))
+
+    def expire(self) -> int:
+        """Removes expired entries, returns number of entries removed"""
+        cursor = self.conn.execute(
+            "DELETE FROM entries WHERE expires IS NOT NULL AND expires <= ?",
+            (time.time(),))
+        return cursor.rowcount
+
+    def evict(self) -> int:
+        """Removes least recently used entries exceeding **max_size**
+
+        Returns the number of entries removed.
+        """
+        if not self.max_size:
+            return 0
+        total, = self.conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(value)), 0) FROM entries").fetchone()
+        if total <= self.max_size:
+            return 0
+        evict = []
+        cursor = self.conn.execute(
+            "SELECT namespace, key, LENGTH(value) FROM entries ORDER BY accessed")
+        for namespace, key, size in cursor:
+            if total <= self.max_size:
+                break
+            evict.append((namespace, key))
+            total -= size
+        cursor.close()
+        self.conn.execute("BEGIN")
+        self.conn.executemany("DELETE FROM entries WHERE namespace=? AND key=?", evict)
+        self.conn.execute("COMMIT")
+        logger.debug("Evicted %i entries from %s", len(evict), self.fname)
+        return len(evict)
+
+
+def parse_retry_after(value: Optional[str], now: float) -> float:
+    """Parses Retry-After header **value** into seconds to wait"""
+    if not value:
+        return 0
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    date = _parse_http_date(value)
+    return max(0, date - now) if date else 0
+
+
+class RequestSkipped(aiohttp.ClientError):
+    """Raised instead of making a request that is known to fail"""
+
+
+class HostUnavailable(RequestSkipped):
+    """Raised while the circuit for a host is open"""
+
+
+class KnownFailure(RequestSkipped):
+    """Raised for URLs that recently failed permanently
+
+    Arguments:
+      url: the URL
+      code: the HTTP status code the URL failed with
+    """
+    def __init__(self, url: str, code: int) -> None:
+        super().__init__(url, code)
+        self.url = url
+        self.code = code
+
+
+class CircuitBreaker():
+    """Stops requests to a host after repeated failures
+
+    After **threshold** consecutive failures (5xx or connection errors),
+    the circuit opens and requests fail with `HostUnavailable` without
+    contacting the host. After **reset_timeout** seconds, requests are
+    let through again. If they fail, the circuit re-opens with twice the
+    timeout (up to **max_timeout**); a success closes it.
+
+    Arguments:
+      host: name of host (for messages)
+      threshold: number of consecutive failures opening the circuit
+      reset_timeout: seconds the circuit initially stays open
+      max_timeout: maximum seconds the circuit stays open
+    """
+    def __init__(self, host: str, threshold: int = 5, reset_timeout: float = 60,
+                 max_timeout: float = 3600) -> None:
+        self.host = host
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.max_timeout = max_timeout
+        #: number of consecutive failures
+        self.failures = 0
+        #: current seconds the circuit stays open
+        self.timeout = reset_timeout
+        #: (monotonic) time circuit was opened or None if closed
+        self.opened_at: Optional[float] = None
+
+    def check(self) -> None:
+        """Raises `HostUnavailable` if the circuit is open"""
+        if self.opened_at is not None and \
+           time.monotonic() < self.opened_at + self.timeout:
+            raise HostUnavailable(self.host)
+
+    def success(self) -> None:
+        """Records a successful request, closing the circuit"""
+        if self.opened_at is not None:
+            logger.info("Host %s is available again", self.host)
+        self.failures = 0
+        self.opened_at = None
+        self.timeout = self.reset_timeout
+
+    def failure(self) -> None:
+        """Records a failed request, opening the circuit if necessary"""
+        self.failures += 1
+        now = time.monotonic()
+        if self.opened_at is not None:
+            if now < self.opened_at + self.timeout:
+                return  # already open
+            # failed again after the timeout
+            self.timeout = min(self.max_timeout, self.timeout * 2)
+        elif self.failures < self.threshold:
+            return
+        self.opened_at = now
+        logger.warning("Host %s failed %i times, not contacting it for %i seconds",
+                       self.host, self.failures, self.timeout)
+
+
+class HostLimiter():
+    """Adaptive concurrency and rate limit for requests to one host
+
+    Requests are started at most at **rate** per second (token bucket
+    allowing bursts of **burst** requests). The number of concurrent
+    requests is adapted AIMD style: it grows by one per window of
+    successful requests and is halved on 429, 5xx or connection errors
+    (at most once per second). A ``Retry-After`` header pauses all
+    requests to the host for the requested time.
+
+    Use as async context manager around a request and pass the response
+    to `feedback`::
+
+       async with limiter:
+           async with session.get(url) as resp:
+               limiter.feedback(resp.status, resp.headers)
+
+    If a `CircuitBreaker` is given, it is informed about failures and
+    successes, and `acquire` raises `HostUnavailable` while it is open.
+
+    Arguments:
+      rate: requests per second (None for unlimited)
+      burst: size of token bucket
+      max_concurrency: upper limit for concurrent requests
+      min_concurrency: lower limit for concurrent requests
+      breaker: circuit breaker for the host
+    """
+
+    #: minimum seconds between two multiplicative decreases
+    DECREASE_INTERVAL = 1.0
+
+    def __init__(self, rate: Optional[float] = None, burst: int = 10,
+                 max_concurrency: int = 8, min_concurrency: int = 1,
+                 breaker: Optional[CircuitBreaker] = None) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        #: current concurrency limit
+        self.concurrency: float = max_concurrency
+        #: number of running requests
+        self.active = 0
+        #: no requests are started before this (monotonic) time
+        self.blocked_until = 0.0
+        self._tokens: float = burst
+        self._refilled = time.monotonic()
+        self._last_decrease = 0.0
+        self._waiters: List[asyncio.Future] = []
+        #: circuit breaker for the host
+        self.breaker = breaker
+
+    def _wait_time(self, now: float) -> Optional[float]:
+        """Seconds until next request may start (None if concurrency limited)"""
+        if self.active >= int(self.concurrency):
+            return None
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.rate is None:
+            return 0
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def _wake(self) -> None:
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters = []
+
+    async def acquire(self) -> None:
+        """Waits until a request may be started
+
+        Raises `HostUnavailable` if the circuit breaker is open.
+        """
+        while True:
+            if self.breaker:
+                self.breaker.check()
+            wait = self._wait_time(time.monotonic())
+            if wait is None:
+                waiter = asyncio.get_event_loop().create_future()
+                self._waiters.append(waiter)
+                try:
+                    await waiter
+                finally:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+            elif wait > 0:
+                await asyncio.sleep(wait)
+            else:
+                if self.rate is not None:
+                    self._tokens -= 1
+                self.active += 1
+                return
+
+    def release(self) -> None:
+        """Marks a request as finished"""
+        self.active -= 1
+        self._wake()
+
+    async def __aenter__(self) -> 'HostLimiter':
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, trace) -> None:
+        if exc_type is not None and issubclass(
+                exc_type, (aiohttp.ClientConnectionError, asyncio.TimeoutError,
+                           ConnectionError)):
+            self.decrease()
+            if self.breaker:
+                self.breaker.failure()
+        self.release()
+
+    def increase(self) -> None:
+        """Additively increases concurrency (by one per window)"""
+        if self.concurrency < self.max_concurrency:
+            self.concurrency = min(self.max_concurrency,
+                                   self.concurrency + 1 / self.concurrency)
+            self._wake()
+
+    def decrease(self) -> None:
+        """Multiplicatively decreases concurrency"""
+        now = time.monotonic()
+        if now - self._last_decrease < self.DECREASE_INTERVAL:
+            return
+        self._last_decrease = now
+        self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+        logger.debug("Reducing concurrency to %i", self.concurrency)
+
+    def feedback(self, status: int, headers: Mapping[str, str]) -> None:
+        """Adapts limits to response **status** and ``Retry-After`` **headers**"""
+        if self.breaker:
+            if status >= 500:
+                self.breaker.failure()
+            elif status != 429:
+                self.breaker.success()
+        if status == 429 or status >= 500:
+            self.decrease()
+            retry_after = parse_retry_after(headers.get("Retry-After"), time.time())
+            if retry_after:
+                self.blocked_until = max(self.blocked_until,
+                                         time.monotonic() + retry_after)
+        else:
+            self.increase()
+
+
 class AsyncRequests():
     """Provides helpers for async access to URLs
     """
@@ -167,56 +942,200 @@ class AsyncRequests():
     #: Used as user agent in http requests and as requester in github API requests
     USER_AGENT = "bioconda/bioconda-utils"
 
-    def __init__(self, cache_fn: str = None) -> None:
+    #: Maximum size of the HTTP cache in bytes
+    HTTP_CACHE_MAX_SIZE = 512 * 1024 * 1024
+
+    #: Drop HTTP cache entries not revalidated for this many seconds
+    HTTP_CACHE_TTL = 30 * 24 * 60 * 60
+
+    #: Maximum size of the (non-HTTP) cache in bytes
+    CACHE_MAX_SIZE = 256 * 1024 * 1024
+
+    #: Seconds after which (non-HTTP) cache entries expire by namespace. Release
+    #: pages and FTP listings change as new versions appear, checksums of a
+    #: given URL rarely do.
+    CACHE_TTL = {
+        'url_text': 24 * 60 * 60,
+        'ftp_list': 24 * 60 * 60,
+        'url_checksum': 90 * 24 * 60 * 60,
+    }
+
+    #: Default limits per host (see `HostLimiter`)
+    HOST_LIMITS = {'rate': 10, 'burst': 10, 'max_concurrency': 8}
+
+    #: Limits differing from `HOST_LIMITS` by host name
+    HOST_LIMITS_OVERRIDE: Dict[str, Dict[str, float]] = {}
+
+    #: HTTP status codes remembered as permanent failures
+    PERMANENT_FAILURES = (404, 410)
+
+    #: Remember permanent failures for this many seconds (not long, as
+    #: e.g. a release page may just not have been published yet)
+    NEGATIVE_CACHE_TTL = 6 * 60 * 60
+
+    def __init__(self, cache_fn: str = None, http_cache_fn: str = None) -> None:
         #: aiohttp session (only exists while running)
         self.session: aiohttp.ClientSession = None
-        self.cache_fn: str = cache_fn
-        #: cache
-        self.cache: Optional[Dict[str, Dict[str, str]]] = None
+        #: cache (url_text, url_checksum and ftp_list expire, but are never revalidated)
+        self.cache: Optional[CacheStore] = None
+        if cache_fn:
+            self.cache = CacheStore(cache_fn, self.CACHE_MAX_SIZE)
+        #: HTTP cache (revalidated using conditional requests)
+        self.http_cache: Optional[CacheStore] = None
+        if http_cache_fn:
+            self.http_cache = CacheStore(http_cache_fn, self.HTTP_CACHE_MAX_SIZE)
+        #: rate and concurrency limits by host
+        self.host_limiters: Dict[str, HostLimiter] = {}
+        #: requests in flight by kind and URL
+        self.inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        #: permanent failures (status code, expiry time) by URL if no HTTP cache
+        self.failures: Dict[str, Tuple[int, float]] = {}
+
+    def get_limiter(self, url: str) -> HostLimiter:
+        """Returns `HostLimiter` for host of **url**"""
+        host = urlparse(url).netloc
+        if host not in self.host_limiters:
+            limits = dict(self.HOST_LIMITS)
+            limits.update(self.HOST_LIMITS_OVERRIDE.get(host, {}))
+            self.host_limiters[host] = HostLimiter(breaker=CircuitBreaker(host), **limits)
+        return self.host_limiters[host]
+
+    def get_failure(self, url: str) -> Optional[int]:
+        """Returns status code if **url** recently failed permanently
+
+        Failures are remembered for `NEGATIVE_CACHE_TTL` seconds, in the
+        HTTP cache if enabled and in memory otherwise.
+        """
+        if self.http_cache is not None:
+            return self.http_cache.get("url_failure", url)
+        code, expires = self.failures.get(url, (None, 0.0))
+        if code is not None and expires <= time.time():
+            del self.failures[url]
+            return None
+        return code
+
+    def set_failure(self, url: str, code: int) -> None:
+        """Remembers that **url** failed permanently with status **code**"""
+        if self.http_cache is not None:
+            self.http_cache.set("url_failure", url, code, self.NEGATIVE_CACHE_TTL)
+        else:
+            self.failures[url] = (code, time.time() + self.NEGATIVE_CACHE_TTL)
+
+    def check_url(self, url: str) -> None:
+        """Raises `RequestSkipped` if a request to **url** is known to fail"""
+        code = self.get_failure(url)
+        if code:
+            raise KnownFailure(url, code)
+        self.get_limiter(url).breaker.check()
+
+    async def single_flight(self, kind: str, url: str,
+                            func: Callable[..., Awaitable[Any]], *args) -> Any:
+        """Runs ``func(*args)`` once for concurrent calls with same **kind** and **url**
+
+        Callers arriving while the request is in flight await the same
+        result (or exception). Cancelling one caller does not cancel the
+        request for the others.
+        """
+        key = (kind, url)
+        future = self.inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func(*args))
+            self.inflight[key] = future
+
+            def done(fut):
+                del self.inflight[key]
+                if not fut.cancelled():
+                    fut.exception()  # mark retrieved in case all callers left
+            future.add_done_callback(done)
+        return await asyncio.shield(future)
+
+    def _check_response(self, url: str, limiter: HostLimiter,
+                        resp: aiohttp.ClientResponse, negative_cache: bool = True) -> None:
+        """Passes **resp** to **limiter** and raises on error status
+
+        Permanent failures are remembered unless **negative_cache** is
+        False, e.g. for source tarballs of new versions, which may be
+        published only after the version was found.
+        """
+        limiter.feedback(resp.status, resp.headers)
+        if negative_cache and resp.status in self.PERMANENT_FAILURES:
+            self.set_failure(url, resp.status)
+        resp.raise_for_status()
 
     async def __aenter__(self) -> 'AsyncRequests':
-        session = aiohttp.ClientSession(headers={'User-Agent': self.USER_AGENT})
+        # connections per host are bounded by the host limiters
+        connector = aiohttp.TCPConnector(limit=0)
+        session = aiohttp.ClientSession(headers={'User-Agent': self.USER_AGENT},
+                                        connector=connector)
         await session.__aenter__()
         self.session = session
-        if self.cache_fn:
-            if os.path.exists(self.cache_fn):
-                with open(self.cache_fn, "rb") as stream:
-                    self.cache = pickle.load(stream)
-            else:
-                self.cache = {}
-            if "url_text" not in self.cache:
-                self.cache["url_text"] = {}
-            if "url_checksum" not in self.cache:
-                self.cache["url_checksum"] = {}
-            if "ftp_list" not in self.cache:
-                self.cache["ftp_list"] = {}
+        for store in (self.cache, self.http_cache):
+            if store is not None:
+                store.open()
         return self
 
     async def __aexit__(self, ext_type, exc, trace):
+        # Requests whose callers were all cancelled keep running (see
+        # `single_flight`) and must not outlive the session and caches.
+        pending = list(self.inflight.values())
+        for future in pending:
+            future.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
         await self.session.__aexit__(ext_type, exc, trace)
         self.session = None
-        if self.cache_fn:
-            with open(self.cache_fn, "wb") as stream:
-                pickle.dump(self.cache, stream)
+        for store in (self.cache, self.http_cache):
+            if store is not None:
+                store.close()
 
-    @backoff.on_exception(backoff.fibo, aiohttp.ClientResponseError, max_tries=20,
-                          giveup=lambda ex: ex.code not in [429, 502, 503, 504])
     async def get_text_from_url(self, url: str) -> str:
         """Fetch content at **url** and return as text
 
         - On non-permanent errors (429, 502, 503, 504), the GET is retried 10 times with
         increasing wait times according to fibonacci series.
         - Permanent errors raise a ClientResponseError
+        - If the HTTP cache is enabled, fresh responses are served from
+          it and stale ones are revalidated using ETag/Last-Modified.
+        - Raises `RequestSkipped` if the URL recently failed permanently
+          or its host is unavailable.
+        - Concurrent calls for the same URL share one request.
         """
-        if self.cache and url in self.cache["url_text"]:
-            return self.cache["url_text"][url]
+        return await self.single_flight("text", url, self._get_text_from_url, url)
+
+    @backoff.on_exception(backoff.fibo, aiohttp.ClientResponseError, max_tries=20,
+                          giveup=lambda ex: ex.code not in [429, 502, 503, 504])
+    async def _get_text_from_url(self, url: str) -> str:
+        """Fetch content at **url** (see `get_text_from_url`)"""
+        if self.cache is not None:
+            res = self.cache.get("url_text", url)
+            if res is not None:
+                return res
+        self.check_url(url)
 
-        async with self.session.get(url) as resp:
-            resp.raise_for_status()
-            res = await resp.text()
+        entry = None
+        if self.http_cache is not None:
+            entry = self.http_cache.get("http", url)
+        now = time.time()
+        if entry and entry.is_fresh(now):
+            return entry.text
 
-        if self.cache:
-            self.cache["url_text"][url] = res
+        headers = entry.conditional_headers() if entry else None
+        limiter = self.get_limiter(url)
+        async with limiter, self.session.get(url, headers=headers) as resp:
+            self._check_response(url, limiter, resp)
+            if entry and resp.status == 304:
+                entry.update(resp.headers, now)
+                res = entry.text
+            else:
+                res = await resp.text()
+                entry = HttpCacheEntry(res, resp.headers, now)
+            if self.http_cache is not None:
+                if is_storable(resp.headers):
+                    self.http_cache.set("http", url, entry, self.HTTP_CACHE_TTL)
+                else:
+                    self.http_cache.delete("http", url)
+
+        if self.cache is not None:
+            self.cache.set("url_text", url, res, self.CACHE_TTL["url_text"])
 
         return res
 
@@ -225,9 +1144,21 @@ class AsyncRequests():
 
         - Shows TQDM progress monitor with label **desc**.
         - Caches result
+        - Raises `RequestSkipped` if the URL recently failed permanently
+          or its host is unavailable. A 404 here is not remembered, as
+          the source of a new version may be published later.
+        - Concurrent calls for the same URL share one download.
         """
-        if self.cache and url in self.cache["url_checksum"]:
-            return self.cache["url_checksum"][url]
+        return await self.single_flight("checksum", url,
+                                        self._get_checksum_from_url, url, desc)
+
+    async def _get_checksum_from_url(self, url: str, desc: str) -> str:
+        """Compute checksum of content at **url** (see `get_checksum_from_url`)"""
+        if self.cache is not None:
+            res = self.cache.get("url_checksum", url)
+            if res is not None:
+                return res
+        self.check_url(url)
 
         parsed = urlparse(url)
         if parsed.scheme in ("http", "https"):
@@ -235,8 +1166,8 @@ class AsyncRequests():
         elif parsed.scheme == "ftp":
             res = await self.get_checksum_from_ftp(url, desc)
 
-        if self.cache:
-            self.cache["url_checksum"][url] = res
+        if self.cache is not None:
+            self.cache.set("url_checksum", url, res, self.CACHE_TTL["url_checksum"])
 
         return res
 
@@ -248,8 +1179,9 @@ class AsyncRequests():
         Shows TQDM progress monitor with label **desc**.
         """
         checksum = sha256()
-        async with self.session.get(url) as resp:
-            resp.raise_for_status()
+        limiter = self.get_limiter(url)
+        async with limiter, self.session.get(url) as resp:
+            self._check_response(url, limiter, resp, negative_cache=False)
             size = int(resp.headers.get("Content-Length", 0))
             with tqdm(total=size, unit='B', unit_scale=True, unit_divisor=1024,
                       desc=desc, miniters=1, leave=False, disable=None) as progress:
@@ -268,8 +1200,9 @@ class AsyncRequests():
 
         Shows TQDM progress monitor with label **desc**.
         """
-        async with self.session.get(url) as resp:
-            resp.raise_for_status()
+        limiter = self.get_limiter(url)
+        async with limiter, self.session.get(url) as resp:
+            self._check_response(url, limiter, resp, negative_cache=False)
             size = int(resp.headers.get("Content-Length", 0))
             with tqdm(total=size, unit='B', unit_scale=True, unit_divisor=1024,
                       desc=desc, miniters=1, leave=False, disable=None) as progress:
@@ -282,17 +1215,27 @@ class AsyncRequests():
                         progress.update(len(block))
 
     async def get_ftp_listing(self, url):
-        """Returns list of files at FTP **url**"""
+        """Returns list of files at FTP **url**
+
+        Concurrent calls for the same URL share one listing.
+        """
+        return await self.single_flight("ftp_list", url, self._get_ftp_listing, url)
+
+    async def _get_ftp_listing(self, url):
+        """Returns list of files at FTP **url** (see `get_ftp_listing`)"""
         logger.debug("FTP: listing %s", url)
-        if self.cache and url in self.cache["ftp_list"]:
-            return self.cache["ftp_list"][url]
+        if self.cache is not None:
+            res = self.cache.get("ftp_list", url)
+            if res is not None:
+                return res
 
         parsed = urlparse(url)
-        async with aioftp.ClientSession(parsed.netloc,
-                                        password=self.USER_AGENT+"@") as client:
+        async with self.get_limiter(url), \
+                aioftp.ClientSession(parsed.netloc,
+                                     password=self.USER_AGENT+"@") as client:
             res = [str(path) for path, _info in await client.list(parsed.path)]
-        if self.cache:
-            self.cache["ftp_list"][url] = res
+        if self.cache is not None:
+            self.cache.set("ftp_list", url, res, self.CACHE_TTL["ftp_list"])
         return res
 
     async def get_checksum_from_ftp(self, url, _desc=None):
@@ -303,8 +1246,9 @@ class AsyncRequests():
         """
         parsed = urlparse(url)
         checksum = sha256()
-        async with aioftp.ClientSession(parsed.netloc,
-                                        password=self.USER_AGENT+"@") as client:
+        async with self.get_limiter(url), \
+                aioftp.ClientSession(parsed.netloc,
+                                     password=self.USER_AGENT+"@") as client:
             async with client.download_stream(parsed.path) as stream:
                 async for block in stream.iter_by_block():
                     checksum.update(block)
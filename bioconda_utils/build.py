@@ -12,6 +12,7 @@ import pandas
 
 from . import utils
 from . import docker_utils
+from . import index
 from . import pkg_test
 from . import upload
 from . import linting
@@ -44,6 +45,7 @@ def build(
     docker_builder=None,
     _raise_error=False,
     lint_args=None,
+    log_dir=None,
 ):
     """
     Build a single recipe for a single env
@@ -82,6 +84,10 @@ def build(
 
     lint_args : linting.LintArgs | None
         If not None, then apply linting just before building.
+
+    log_dir : str | None
+        If not None, the complete output of the build and of the mulled test
+        is written gzip compressed to per-recipe files in this directory.
     """
 
     if lint_args is not None:
@@ -135,6 +141,11 @@ def build(
     # name, version, noarch, whether or not an extended container was used)
     meta = utils.load_first_metadata(recipe)
 
+    build_log = None
+    if log_dir is not None:
+        log_name = os.path.relpath(recipe, recipe_folder).replace(os.path.sep, '-')
+        build_log = os.path.join(log_dir, log_name + '.build.log.gz')
+
     try:
         # Note we're not sending the contents of os.environ here. But we do
         # want to add TRAVIS* vars if that behavior is not disabled.
@@ -144,7 +155,8 @@ def build(
                 recipe_dir=os.path.abspath(recipe),
                 build_args=' '.join(channel_args + build_args),
                 env=whitelisted_env,
-                noarch=bool(meta.get_value('build/noarch', default=False))
+                noarch=bool(meta.get_value('build/noarch', default=False)),
+                logfile=build_log,
             )
 
             for pkg_path in pkg_paths:
@@ -166,7 +178,8 @@ def build(
                 cmd += [os.path.join(recipe, 'meta.yaml')]
                 logger.debug('command: %s', cmd)
                 with utils.Progress():
-                    utils.run(cmd, env=os.environ, mask=False)
+                    utils.run(cmd, env=os.environ, mask=False,
+                              stream=True, logfile=build_log)
 
         logger.info('BUILD SUCCESS %s',
                     ' '.join(os.path.basename(p) for p in pkg_paths))
@@ -177,6 +190,10 @@ def build(
                 raise e
             return BuildResult(False, None)
 
+    # Publish the packages to the local channel, so that recipes built later
+    # in this job (and the mulled tests below) can install them
+    index.update_channel_index(pkg_paths)
+
     if not mulled_test:
         return BuildResult(True, None)
 
@@ -185,16 +202,26 @@ def build(
     use_base_image = meta.get_value('extra/container', {}).get('extended-base', False)
     base_image = 'bioconda/extended-base-image' if use_base_image else None
 
+    test_logs = None
+    if log_dir is not None:
+        test_logs = {
+            pkg_path: os.path.join(
+                log_dir, utils.package_dist_name(pkg_path) + '.test.log.gz')
+            for pkg_path in pkg_paths
+        }
+    results = pkg_test.test_packages(pkg_paths, base_image=base_image,
+                                     logfiles=test_logs)
+
     mulled_images = []
     for pkg_path in pkg_paths:
-        try:
-            pkg_test.test_package(pkg_path, base_image=base_image)
-        except sp.CalledProcessError as e:
-            logger.error('TEST FAILED: %s', recipe)
-            return BuildResult(False, None)
+        if results[pkg_path] is not None:
+            logger.error('TEST FAILED: %s', pkg_path)
         else:
-            logger.info("TEST SUCCESS %s", recipe)
+            logger.info("TEST SUCCESS %s", pkg_path)
             mulled_images.append(pkg_test.get_image_name(pkg_path))
+    if len(mulled_images) < len(pkg_paths):
+        logger.error('TEST FAILED: %s', recipe)
+        return BuildResult(False, None)
     return BuildResult(True, mulled_images)
 
 
@@ -211,6 +238,9 @@ def build_recipes(
     mulled_upload_target=None,
     check_channels=None,
     lint_args=None,
+    log_dir=None,
+    upload_jobs=upload.MAX_WORKERS,
+    lint_jobs=1,
 ):
     """
     Build one or many bioconda packages.
@@ -260,7 +290,20 @@ def build_recipes(
         channels.
 
     lint_args : linting.LintArgs | None
-        If not None, then apply linting just before building.
+        If not None, then lint all recipes to be built before building any.
+        Recipes failing linting are not built, and neither are the recipes
+        depending on them.
+
+    log_dir : str | None
+        If not None, store compressed build and test logs for each recipe in
+        this directory (created if needed).
+
+    upload_jobs : int
+        Number of uploads (packages and images) to run concurrently. Uploads
+        run in the background while the following recipes are built.
+
+    lint_jobs : int
+        Number of recipes to lint in parallel processes (with **lint_args**).
     """
     orig_config = config
     config = utils.load_config(config)
@@ -290,6 +333,9 @@ def build_recipes(
 
     logger.debug('recipes: %s', recipes)
 
+    if log_dir is not None:
+        os.makedirs(log_dir, exist_ok=True)
+
     if lint_args is not None:
         lint_exclude = (lint_args.exclude or ())
         if 'already_in_bioconda' not in lint_exclude:
@@ -378,10 +424,24 @@ def build_recipes(
         subdag_i + 1, subdags_n, len(recipes)
     )
 
+    # Lint all recipes at once rather than each just before building it
+    lint_failures = {}
+    if lint_args is not None:
+        logger.info('Linting %s recipes', len(recipes))
+        reporter = linting.DataFrameReporter()
+        linting.lint(recipes, lint_args, jobs=lint_jobs, reporter=reporter)
+        lint_failures = reporter.failed
+        if lint_failures:
+            logger.error('\n\nThe following recipes failed linting. See '
+                         'https://bioconda.github.io/linting.html for details:\n\n%s\n',
+                         reporter.summary().to_string())
+
     built_recipes = []
     skipped_recipes = []
     all_success = True
-    failed_uploads = []
+    uploader = upload.UploadManager(
+        label=label, channel=config['upload_channel'],
+        quay_target=mulled_upload_target, max_workers=upload_jobs)
 
     for recipe in recipes:
         recipe_success = True
@@ -423,6 +483,16 @@ def build_recipes(
             logger.info("Nothing to be done for recipe %s", recipe)
             continue
 
+        if recipe in lint_failures:
+            logger.error(
+                'BUILD ERROR: '
+                'recipe %s failed linting: %s',
+                recipe, ', '.join(lint_failures[recipe]))
+            failed.append(recipe)
+            for n in nx.algorithms.descendants(subdag, name):
+                skip_dependent[n].append(recipe)
+            continue
+
         # If a recipe depends on conda, it means it must be installed in
         # the root env, which is not compatible with mulled-build tests. In
         # that case, we temporarily disable the mulled-build tests for the
@@ -448,7 +518,7 @@ def build_recipes(
             force=force,
             channels=config['channels'],
             docker_builder=docker_builder,
-            lint_args=lint_args,
+            log_dir=log_dir,
         )
 
         all_success &= res.success
@@ -459,14 +529,12 @@ def build_recipes(
             for n in nx.algorithms.descendants(subdag, name):
                 skip_dependent[n].append(recipe)
         elif not testonly:
-            for pkg in pkg_paths:
-                # upload build
-                if anaconda_upload:
-                    if not upload.anaconda_upload(pkg, label=label):
-                        failed_uploads.append(pkg)
+            if anaconda_upload:
+                for pkg in pkg_paths:
+                    uploader.upload_package(pkg)
             if mulled_upload_target and keep_mulled_test:
                 for img in res.mulled_images:
-                    upload.mulled_upload(img, mulled_upload_target)
+                    uploader.upload_image(img)
 
         # remove traces of the build
         purge()
@@ -474,6 +542,9 @@ def build_recipes(
         if recipe_success:
             built_recipes.append(recipe)
 
+    with uploader:
+        failed_uploads = uploader.wait()
+
     if failed or failed_uploads:
         logger.error(
             'BUILD SUMMARY: of %s recipes, '
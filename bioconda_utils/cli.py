@@ -4,6 +4,7 @@ import sys
 import os
 import shlex
 import logging
+import subprocess as sp
 from collections import defaultdict
 
 import argh
@@ -20,6 +21,7 @@ from . import linting
 from . import github_integration
 from . import bioconductor_skeleton as _bioconductor_skeleton
 from . import cran_skeleton
+from . import upload
 
 logger = logging.getLogger(__name__)
 
@@ -116,23 +118,30 @@ def duplicates(config,
         check_fields += ['build']
 
     def remove_package(spec):
-        fn = '{}-{}-{}.tar.bz2'.format(*spec)
+        dist = '{}-{}-{}'.format(*spec)
         name, version = spec[:2]
-        subcmd = [
-            'remove', '-f',
-            '{channel}/{name}/{version}/{fn}'.format(
-                name=name, version=version, fn=fn, channel=our_channel
-            )
-        ]
-        if dryrun:
-            logger.info(" ".join([utils.bin_for('anaconda')] + subcmd))
-        else:
+        # the build may have been uploaded in any (or all) package formats
+        for ext in utils.PACKAGE_EXTENSIONS:
+            subcmd = [
+                'remove', '-f',
+                '{channel}/{name}/{version}/{fn}'.format(
+                    name=name, version=version, fn=dist + ext, channel=our_channel
+                )
+            ]
+            if dryrun:
+                logger.info(" ".join([utils.bin_for('anaconda')] + subcmd))
+                continue
             token = os.environ.get('ANACONDA_TOKEN')
             if token is None:
                 token = []
             else:
                 token = ['-t', token]
-            logger.info(utils.run([utils.bin_for('anaconda')] + token + subcmd, mask=[token]).stdout)
+            try:
+                logger.info(utils.run([utils.bin_for('anaconda')] + token + subcmd,
+                                      mask=token[1:]).stdout)
+            except sp.CalledProcessError:
+                logger.info("Could not remove %s%s from %s (not uploaded in this format?)",
+                            dist, ext, our_channel)
 
     # packages in our channel
     repodata = utils.RepoData()
@@ -207,12 +216,39 @@ def duplicates(config,
 @arg('--full-report', action='store_true', help='''Default behavior is to
      summarize the linting results; use this argument to get the full
      results as a TSV printed to stdout.''')
+@arg('--jobs', '-j', type=int, help='''Number of recipes to lint in parallel
+     processes.''')
+@arg('--lint-cache', help='''Cache lint results per recipe in the provided
+     filename. Recipes are only linted again if the recipe, the lint functions
+     or the skip directives have changed. Lint functions checking the channel
+     data are always applied to all recipes.''')
+@arg('--fast', action='store_true', help='''Only apply lint functions that
+     need neither the variants rendered by conda-build nor the channel data,
+     to the raw meta.yaml. Recipes are only rendered if they cannot be parsed
+     otherwise.''')
+@arg('--full-matrix', action='store_true', help='''Render all variants of the
+     conda build config. By default, only one variant is rendered for each
+     combination of the variant keys used in selectors and Jinja2 conditions
+     of a recipe.''')
+@arg('--stream', choices=linting.StreamReporter.formats, help='''Write the
+     linting results to stdout in the given format as each recipe is linted,
+     rather than collecting them until the end. Implies --full-report.''')
+@arg('--profile', help='''Record the time spent parsing and rendering each
+     recipe, in each linting function and loading and querying the channel
+     data. A summary is logged and all timings are written as JSON to the
+     provided filename.''')
+@arg('--watch', action='store_true', help='''Keep running and lint recipes
+     matching --packages again whenever their files change. Configuration and
+     channel data are only loaded once.''')
+@arg('--watch-interval', type=float, help='''Seconds between checks for changed
+     files in --watch mode.''')
 @arg('--loglevel', help="Set logging level (debug, info, warning, error, critical)")
 def lint(recipe_folder, config, packages="*", cache=None, list_funcs=False,
          only=None, exclude=None, force=False, push_status=False, user='bioconda',
          commit=None, push_comment=False, pull_request=None,
          repo='bioconda-recipes', git_range=None, full_report=False,
-         loglevel='info'):
+         jobs=1, lint_cache=None, fast=False, full_matrix=False, stream=None,
+         profile=None, watch=False, watch_interval=1.0, loglevel='info'):
     """
     Lint recipes
 
@@ -238,23 +274,42 @@ def lint(recipe_folder, config, packages="*", cache=None, list_funcs=False,
     config_filename = config
     config = utils.load_config(config)
 
-    _recipes = select_recipes(packages, git_range, recipe_folder, config_filename, config, force)
-
     lint_args = linting.LintArgs(exclude=exclude, registry=registry)
-    report = linting.lint(_recipes, lint_args)
 
-    # The returned dataframe is in tidy format; summarize a bit to get a more
-    # reasonable log
-    if report is not None:
+    if watch:
+        try:
+            linting.watch(recipe_folder, lint_args, packages=packages,
+                          interval=watch_interval, jobs=jobs, cache=lint_cache,
+                          fast=fast, full_matrix=full_matrix)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    _recipes = select_recipes(packages, git_range, recipe_folder, config_filename, config, force)
+
+    if stream is not None:
+        reporter = linting.StreamReporter(sys.stdout, stream)
+    else:
+        reporter = linting.DataFrameReporter()
+    lint_profile = linting.LintProfile() if profile is not None else None
+    report = linting.lint(_recipes, lint_args, jobs=jobs, cache=lint_cache,
+                          fast=fast, full_matrix=full_matrix, reporter=reporter,
+                          profile=lint_profile)
+    if lint_profile is not None:
+        logger.info('Lint profile:\n%s', lint_profile.summary())
+        lint_profile.dump(profile)
+
+    # The report is in tidy format; summarize a bit to get a more reasonable
+    # log
+    summarized = reporter.summary()
+    if summarized is not None:
         pandas.set_option('max_colwidth', 500)
-        summarized = pandas.DataFrame(
-            dict(failed_tests=report.groupby('recipe')['check'].agg('unique')))
-        if not full_report:
+        if full_report and report is not None:
+            report.to_csv(sys.stdout, sep='\t')
+        elif stream is None:
             logger.error('\n\nThe following recipes failed linting. See '
                          'https://bioconda.github.io/linting.html for details:\n\n%s\n',
                          summarized.to_string())
-        else:
-            report.to_csv(sys.stdout, sep='\t')
 
         if push_status:
             github_integration.update_status(
@@ -311,10 +366,12 @@ def lint(recipe_folder, config, packages="*", cache=None, list_funcs=False,
 @arg('--keep-image', action='store_true', help='''After building recipes, the
      created Docker image is removed by default to save disk space. Use this
      argument to disable this behavior.''')
-@arg('--lint', '--prelint', action='store_true', help='''Just before each recipe, apply
-     the linting functions to it. This can be used as an alternative to linting
-     all recipes before any building takes place with the `bioconda-utils lint`
-     command.''')
+@arg('--lint', '--prelint', action='store_true', help='''Before building, apply
+     the linting functions to the recipes to be built. Recipes failing linting
+     are not built, and neither are recipes depending on them. This can be used
+     as an alternative to running the `bioconda-utils lint` command.''')
+@arg('--lint-jobs', type=int, help='''Number of recipes to lint in parallel
+     processes with --lint.''')
 @arg('--lint-only', nargs='+',
      help='''Only run this linting function. Can be used multiple times.''')
 @arg('--lint-exclude', nargs='+',
@@ -324,6 +381,11 @@ def lint(recipe_folder, config, packages="*", cache=None, list_funcs=False,
      already present in one of these channels will be skipped. The default is
      the first two channels specified in the config file. Note that this is
      ignored if you specify --git-range.''')
+@arg('--log-dir', help='''Directory in which to store the complete, gzip
+     compressed build and test output of each recipe. Only the last lines of
+     the output are shown in the log on failure.''')
+@arg('--upload-jobs', type=int, help='''Number of package and image uploads to
+     run concurrently (with --anaconda-upload or --mulled-upload-target).''')
 def build(
     recipe_folder,
     config,
@@ -343,6 +405,9 @@ def build(
     lint_only=None,
     lint_exclude=None,
     check_channels=None,
+    log_dir=None,
+    upload_jobs=upload.MAX_WORKERS,
+    lint_jobs=1,
 ):
     utils.setup_logger('bioconda_utils', loglevel)
 
@@ -424,6 +489,9 @@ def build(
         lint_args=lint_args,
         check_channels=check_channels,
         label=label,
+        log_dir=log_dir,
+        upload_jobs=upload_jobs,
+        lint_jobs=lint_jobs,
     )
     exit(0 if success else 1)
 
@@ -628,6 +696,10 @@ def clean_cran_skeleton(recipe, no_windows=False):
      the provided filename. If the file does not exist, it will be created
      the first time. Caution: The cache will not be updated if
      exclude-channels is changed''')
+@arg('--http-cache', help='''Keep downloaded release pages in this file and
+     revalidate them with conditional requests on the next run. Defaults to
+     $XDG_CACHE_HOME/bioconda-utils/autobump_http.sqlite. Set to 'none' to
+     disable.''')
 @arg('--unparsed-urls', help='''Write unrecognized urls to this file''')
 @arg('--failed-urls', help='''Write urls with permanent failure to this file''')
 @arg('--recipe-status', help='''Write status for each recipe to this file''')
@@ -639,15 +711,28 @@ def clean_cran_skeleton(recipe, no_windows=False):
      Implies create-branch.''')
 @arg("--max-updates", help='''Exit after ARG updates''')
 @arg("--parallel", help='''Maximum number of recipes to consider in parallel''')
+@arg("--stage-limits", nargs="+", help='''Maximum number of recipes processed
+     in parallel by individual stages, given as STAGE=N (e.g.
+     UpdateVersion=200 UpdateChecksums=20). Use N=0 to remove the limit;
+     negative values are rejected.''')
+@arg("--io-workers", type=int, help='''Number of threads for blocking I/O
+     (default: number of CPUs + 4, at most 32)''')
+@arg("--proc-workers", type=int, help='''Number of processes for parsing
+     recipes and determining requirements (default: number of CPUs)''')
+@arg("--parse-in-threads", action="store_true", help='''Parse recipes in I/O
+     threads instead of worker processes. Avoids the cost of passing recipes
+     between processes at the expense of contention for the GIL.''')
 @arg("--dry-run", help='''Don't update remote git or github"''')
 def autobump(recipe_folder, config, loglevel='info', packages='*', cache=None,
-             failed_urls=None, unparsed_urls=None, recipe_status=None,
+             http_cache=None, failed_urls=None, unparsed_urls=None, recipe_status=None,
              exclude_subrecipes=None, exclude_channels='conda-forge',
              ignore_blacklists=False,
              no_fetch_requirements=False,
              check_branch=False, create_branch=False, create_pr=False,
              only_active=False,
-             max_updates=0, parallel=100, dry_run=False):
+             max_updates=0, parallel=100, stage_limits=None,
+             io_workers=None, proc_workers=None, parse_in_threads=False,
+             dry_run=False):
     """
     Updates recipes in recipe_folder
     """
@@ -658,10 +743,20 @@ def autobump(recipe_folder, config, loglevel='info', packages='*', cache=None,
     from . import githandler
     from . import githubhandler
     from . import hosters
+    if http_cache is None:
+        http_cache = os.path.join(
+            os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+            "bioconda-utils", "autobump_http.sqlite")
+    elif http_cache == "none":
+        http_cache = None
     scanner = update.Scanner(recipe_folder, packages,
-                             cache and cache + "_scan.pkl",
+                             cache and cache + "_scan.sqlite",
                              max_inflight=parallel,
-                             status_fn=recipe_status)
+                             status_fn=recipe_status,
+                             http_cache_fn=http_cache,
+                             io_workers=io_workers,
+                             proc_workers=proc_workers,
+                             parse_in_threads=parse_in_threads)
     if not ignore_blacklists:
         scanner.add(update.ExcludeBlacklisted, config)
     if exclude_subrecipes != "never":
@@ -702,6 +797,13 @@ def autobump(recipe_folder, config, loglevel='info', packages='*', cache=None,
 
     if max_updates:
         scanner.add(update.MaxUpdates, max_updates)
+    for stage_limit in stage_limits or []:
+        stage, _, limit = stage_limit.partition("=")
+        try:
+            scanner.set_max_concurrency(stage, int(limit) or None)
+        except ValueError as exc:
+            logger.critical("Invalid stage limit '%s': %s", stage_limit, exc)
+            exit(1)
     scanner.run()
     if git_handler:
         git_handler.close()
@@ -436,7 +436,7 @@ class RecipeBuilder(object):
             shutil.rmtree(build_dir)
         return p
 
-    def build_recipe(self, recipe_dir, build_args, env, noarch=False):
+    def build_recipe(self, recipe_dir, build_args, env, noarch=False, logfile=None):
         """
         Build a single recipe.
 
@@ -456,6 +456,10 @@ class RecipeBuilder(object):
         noarch: bool
             Has to be set to true if this is a noarch build
 
+        logfile : str or None
+            If given, the complete container output is written gzip compressed
+            to this file.
+
         Note that the binds are set up automatically to match the expectations
         of the build script, and will use the currently-configured
         self.container_staging and self.container_recipe.
@@ -504,7 +508,7 @@ class RecipeBuilder(object):
 
         logger.debug('DOCKER: cmd: %s', cmd)
         with utils.Progress():
-            p = utils.run(cmd, mask=False)
+            p = utils.run(cmd, mask=False, stream=True, logfile=logfile)
         return p
 
     def cleanup(self):
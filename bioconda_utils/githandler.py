@@ -3,6 +3,7 @@
 import asyncio
 import logging
 import os
+import threading
 
 import git
 
@@ -40,6 +41,12 @@ class GitHandler():
         self.dry_run = dry_run
         #: Semaphore for things that mess with workding directory
         self.lock_working_dir = asyncio.Semaphore(1)
+        #: Semaphore for things that modify branches
+        self.lock_branches = asyncio.Semaphore(1)
+        #: Repo instances used by other threads (GitPython is not thread safe)
+        self._thread_local = threading.local()
+        self._thread_repos = []
+        self._thread_repos_lock = threading.Lock()
         #: Remote upstream (for pulling)
         self.upstream = self.get_remote(upstream)
         self.upstream.fetch(prune=True)
@@ -105,8 +112,23 @@ class GitHandler():
             return self.origin.refs[branch_name]
         return None
 
+    def get_thread_repo(self):
+        """Returns Repo instance for use in the current thread"""
+        if threading.current_thread() is threading.main_thread():
+            return self.repo
+        repo = getattr(self._thread_local, "repo", None)
+        if repo is None:
+            repo = git.Repo(self.repo.working_dir)
+            self._thread_local.repo = repo
+            with self._thread_repos_lock:
+                self._thread_repos.append(repo)
+        return repo
+
     def read_from_branch(self, branch, file_name: str) -> str:
-        """Reads contents of file **file_name** from git branch **branch**"""
+        """Reads contents of file **file_name** from git branch **branch**
+
+        May be called from several threads concurrently.
+        """
         abs_file_name = os.path.abspath(file_name)
         abs_repo_root = os.path.abspath(self.repo.working_dir)
         if not abs_file_name.startswith(abs_repo_root):
@@ -114,7 +136,8 @@ class GitHandler():
                 f"File {abs_file_name} not inside {abs_repo_root}"
             )
         rel_file_name = abs_file_name[len(abs_repo_root):].lstrip("/")
-        return (branch.commit.tree / rel_file_name).data_stream.read().decode("utf-8")
+        commit = self.get_thread_repo().commit(branch.path)
+        return (commit.tree / rel_file_name).data_stream.read().decode("utf-8")
 
     def create_local_branch(self, branch_name: str):
         """Creates local branch from remote **branch_name**"""
@@ -158,4 +181,6 @@ class GitHandler():
         logger.warning("Switching back to %s", self.prev_active_branch.name)
         self.prev_active_branch.checkout()
 
+        for repo in self._thread_repos:
+            repo.close()
         self.repo.close()
@@ -0,0 +1,175 @@
+"""
+Incremental indexing of local conda channels.
+
+`conda index` re-reads every package file in a channel subdir each time it is
+called. While building and testing many recipes in one job, the local
+conda-bld channel keeps growing and re-indexing it for every tested package
+becomes expensive.
+
+`update_index` instead keeps a per-subdir cache of the repodata entry of each
+package file (keyed by file name, size and modification time) and only reads
+package files that are new or have changed since the last call.
+
+Besides ``repodata.json`` (and its ``.bz2``), ``current_repodata.json`` is
+written as well. conda >= 4.7 reads that file first, so a stale copy left by
+an earlier ``conda index`` would hide newly added packages.
+"""
+
+import bz2
+import hashlib
+import json
+import logging
+import os
+
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+
+#: Cache of per-file repodata entries, relative to the subdir
+CACHE_FILE = os.path.join('.cache', 'bioconda-utils-index.json')
+
+#: Repodata files written to each subdir
+REPODATA_FILES = ('repodata.json', 'repodata.json.bz2', 'current_repodata.json')
+
+
+def _write_atomic(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fout:
+        fout.write(data)
+    os.replace(tmp, path)
+
+
+def _load_cache(subdir):
+    path = os.path.join(subdir, CACHE_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as fin:
+            return json.load(fin)
+    except ValueError:
+        logger.warning('INDEX: ignoring corrupt cache %s', path)
+        return {}
+
+
+def _save_cache(subdir, cache):
+    path = os.path.join(subdir, CACHE_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _write_atomic(path, json.dumps(cache).encode())
+
+
+def package_record(path):
+    """
+    Returns the repodata entry for the package file at **path**.
+
+    The entry is the package's ``info/index.json`` amended with the size and
+    checksums of the file.
+    """
+    record = None
+    for _, content in utils.iter_package_info(path, names=['info/index.json']):
+        record = json.loads(content.decode())
+    if record is None:
+        raise ValueError('{} has no info/index.json'.format(path))
+
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(1024 * 1024), b''):
+            md5.update(block)
+            sha256.update(block)
+    record['md5'] = md5.hexdigest()
+    record['sha256'] = sha256.hexdigest()
+    record['size'] = os.path.getsize(path)
+    return record
+
+
+def update_index(subdir):
+    """
+    Update ``repodata.json`` and ``current_repodata.json`` of a local
+    channel subdir.
+
+    Only package files added or modified since the last call are read;
+    entries of removed files are dropped. The subdir is created if it does
+    not exist, so that e.g. an empty ``noarch`` is valid for conda.
+
+    Parameters
+    ----------
+    subdir : str
+        Path to a channel subdir (e.g. ``conda-bld/linux-64``)
+
+    Returns
+    -------
+    Number of package files that had to be (re-)read.
+    """
+    os.makedirs(subdir, exist_ok=True)
+    cache = _load_cache(subdir)
+
+    new_cache = {}
+    n_read = 0
+    for fn in sorted(os.listdir(subdir)):
+        if not fn.endswith(utils.PACKAGE_EXTENSIONS):
+            continue
+        path = os.path.join(subdir, fn)
+        stat = os.stat(path)
+        cached = cache.get(fn)
+        if (cached is not None and cached['size'] == stat.st_size
+                and cached['mtime'] == stat.st_mtime):
+            new_cache[fn] = cached
+            continue
+        try:
+            record = package_record(path)
+        except Exception as e:  # broken or partially written package
+            logger.warning('INDEX: skipping %s: %s', path, e)
+            continue
+        n_read += 1
+        new_cache[fn] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'record': record,
+        }
+
+    if (not n_read and new_cache.keys() == cache.keys()
+            and all(os.path.exists(os.path.join(subdir, fn))
+                    for fn in REPODATA_FILES)):
+        logger.debug('INDEX: %s is up to date', subdir)
+        return 0
+
+    repodata = {
+        'info': {'subdir': os.path.basename(os.path.normpath(subdir))},
+        'packages': {fn: entry['record'] for fn, entry in new_cache.items()
+                     if not fn.endswith('.conda')},
+        'packages.conda': {fn: entry['record'] for fn, entry in new_cache.items()
+                           if fn.endswith('.conda')},
+        'repodata_version': 1,
+    }
+    data = json.dumps(repodata, indent=2, sort_keys=True).encode()
+    _write_atomic(os.path.join(subdir, 'repodata.json'), data)
+    _write_atomic(os.path.join(subdir, 'repodata.json.bz2'), bz2.compress(data))
+    # The full repodata is a valid (if not minimal) current_repodata
+    _write_atomic(os.path.join(subdir, 'current_repodata.json'), data)
+    _save_cache(subdir, new_cache)
+
+    logger.debug('INDEX: %s: %s packages, %s (re-)read',
+                 subdir, len(new_cache), n_read)
+    return n_read
+
+
+def update_channel_index(paths):
+    """
+    Update the index of the local channel subdirs containing **paths**.
+
+    The ``noarch`` subdir of each channel is always indexed, as conda
+    requires it to exist.
+
+    Parameters
+    ----------
+    paths : list
+        Paths to package files in a local channel (e.g. ``conda-bld``)
+    """
+    subdirs = set()
+    for path in paths:
+        subdir = os.path.abspath(os.path.dirname(path))
+        subdirs.add(subdir)
+        subdirs.add(os.path.join(os.path.dirname(subdir), 'noarch'))
+    for subdir in sorted(subdirs):
+        update_index(subdir)
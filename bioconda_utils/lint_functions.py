@@ -1,5 +1,5 @@
-from functools import partial
-import glob
+from functools import partial, wraps
+import fnmatch
 import os
 import re
 
@@ -35,21 +35,136 @@ def _get_deps(meta, section=None):
     return deps
 
 
+#: Matches lines with preprocessing selectors, e.g. ``# [osx]``. From
+#: ``conda_build/metadata.py`` of conda-build (commit cce72a9, line 107).
+SELECTOR_RE = re.compile(r'(.+?)\s*(#.*)?\[([^\[\]]+)\](?(2).*)$')
+
+#: Matches the condition of Jinja2 ``if`` and ``elif`` statements
+JINJA_CONDITION_RE = re.compile(r'{%-?\s*(?:el)?if\s(.*?)-?%}')
+
+#: Matches identifiers in selectors and conditions
+IDENTIFIER_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+#: Selector shorthands referring to variant keys (e.g. ``py27``, ``np115``)
+SELECTOR_VARIABLES = (
+    (re.compile(r'py(\d+|[23]k)?$'), 'python'),
+    (re.compile(r'np(\d+)?$'), 'numpy'),
+)
+
+
+class LintContext:
+    """
+    Files of a recipe, read at most once however many lint functions use them.
+
+    An instance is passed as the ``recipe`` argument to the lint functions.
+    It can be used wherever a path is expected (e.g. `os.path.join`); lint
+    functions looking at the files of a recipe should use `lint_context`
+    and the methods below instead of opening them themselves.
+    """
+    def __init__(self, path, channels=None):
+        self.path = path
+        #: `linting.PackageChannels` precomputed for all linted recipes
+        self.channels = channels
+        self._files = None
+        self._contents = {}
+        self._lines = {}
+        self._has_selectors = None
+        self._variables = None
+
+    def __fspath__(self):
+        return self.path
+
+    def __str__(self):
+        return self.path
+
+    def __repr__(self):
+        return 'LintContext({!r})'.format(self.path)
+
+    @property
+    def files(self):
+        """Names of the files in the recipe directory"""
+        if self._files is None:
+            self._files = sorted(
+                fn for fn in os.listdir(self.path)
+                if os.path.isfile(os.path.join(self.path, fn)))
+        return self._files
+
+    def exists(self, fn):
+        """Does the file **fn** exist in the recipe directory?"""
+        return fn in self.files
+
+    def glob(self, pattern):
+        """Returns the names of the recipe files matching **pattern**"""
+        return fnmatch.filter(self.files, pattern)
+
+    def read(self, fn):
+        """Returns the contents of recipe file **fn** or None if missing"""
+        if fn not in self._contents:
+            content = None
+            if self.exists(fn):
+                with open(os.path.join(self.path, fn)) as fin:
+                    content = fin.read()
+            self._contents[fn] = content
+        return self._contents[fn]
+
+    def lines(self, fn):
+        """Returns the lines of recipe file **fn** (empty if missing)"""
+        if fn not in self._lines:
+            self._lines[fn] = (self.read(fn) or '').splitlines()
+        return self._lines[fn]
+
+    @property
+    def has_selectors(self):
+        """Does meta.yaml contain any preprocessing selectors?"""
+        if self._has_selectors is None:
+            self._has_selectors = any(
+                SELECTOR_RE.match(line.rstrip())
+                for line in self.lines('meta.yaml')
+                if not line.startswith('#'))
+        return self._has_selectors
+
+    @property
+    def variables(self):
+        """
+        Names used in the selectors and Jinja2 conditions of meta.yaml, with
+        selector shorthands mapped to the variant keys they refer to (e.g.
+        ``py27`` to ``python``)
+        """
+        if self._variables is None:
+            names = set()
+            for line in self.lines('meta.yaml'):
+                conditions = JINJA_CONDITION_RE.findall(line)
+                match = SELECTOR_RE.match(line.rstrip())
+                if match and not line.startswith('#'):
+                    conditions.append(match.group(3))
+                for condition in conditions:
+                    for name in IDENTIFIER_RE.findall(condition):
+                        for pattern, variable in SELECTOR_VARIABLES:
+                            if pattern.match(name):
+                                name = variable
+                                break
+                        names.add(name)
+            self._variables = names
+        return self._variables
+
+
+def lint_context(recipe):
+    """
+    Returns the `LintContext` for **recipe**, which may be a path or a
+    context already.
+    """
+    if isinstance(recipe, LintContext):
+        return recipe
+    return LintContext(recipe)
+
+
 def _has_preprocessing_selector(recipe):
     """
     Does the package have any preprocessing selectors?
 
     # [osx], # [not py27], etc.
     """
-    # regex from
-    # https://github.com/conda/conda-build/blob/cce72a95c61b10abc908ab1acf1e07854a236a75/conda_build/metadata.py#L107
-    sel_pat = re.compile(r'(.+?)\s*(#.*)?\[([^\[\]]+)\](?(2).*)$')
-    for line in open(os.path.join(recipe, 'meta.yaml')):
-        line = line.rstrip()
-        if line.startswith('#'):
-            continue
-        if sel_pat.match(line):
-            return True
+    return lint_context(recipe).has_selectors
 
 
 def _has_compilers(meta):
@@ -62,6 +177,7 @@ def _has_compilers(meta):
 
 
 def lint_multiple_metas(lint_function):
+    @wraps(lint_function)
     def lint_metas(recipe, metas, *args, **kwargs):
         lint = partial(lint_function, recipe)
         for meta in metas:
@@ -69,20 +185,73 @@ def lint_multiple_metas(lint_function):
             if ret is not None:
                 ret['output'] = meta.name()
                 return ret
-    lint_metas.__name__ = lint_function.__name__
     return lint_metas
 
 
+def needs_render(lint_function):
+    """
+    Marks a lint function as needing the variants rendered by conda-build.
+
+    In the fast lint tier (``bioconda-utils lint --fast``), lint functions
+    without this mark are applied to the raw recipe as parsed by
+    `recipe.Recipe` (Jinja2 and YAML only: no selectors applied, no
+    variants, no outputs), which avoids rendering the recipe.
+    """
+    lint_function.needs_render = True
+    return lint_function
+
+
+def needs_full_matrix(lint_function):
+    """
+    Marks a lint function as needing all variants of the conda build config
+    rendered, rather than one representative variant for each combination
+    of the variant keys used in selectors and Jinja2 conditions.
+    """
+    lint_function.needs_full_matrix = True
+    return lint_function
+
+
+def uses_repodata(lint_function):
+    """
+    Marks a lint function as querying the channel data in `utils.RepoData`.
+
+    `linting.lint` applies such functions after all recipes have been
+    rendered, with the channels of all packages looked up at once (see
+    `_package_channels`). They are passed stand-ins for the metas that only
+    provide ``package/name``, ``package/version``, ``build/number`` and
+    ``extra/skip-lints``.
+    """
+    lint_function.uses_repodata = True
+    return lint_function
+
+
+def _package_channels(recipe, meta, with_build_number=False):
+    """
+    Returns the set of channels containing the package of **meta**.
+
+    Uses the channels precomputed for the lint run if available, otherwise
+    queries `utils.RepoData`.
+    """
+    name = meta.get_value("package/name")
+    version = meta.get_value("package/version")
+    build_number = None
+    if with_build_number:
+        build_number = meta.get_value("build/number", 0)
+    channels = lint_context(recipe).channels
+    if channels is not None:
+        return channels.get(name, version, build_number)
+    return set(utils.RepoData().get_package_data(
+        key="channel", name=name, version=version, build_number=build_number
+    ))
+
+
+@uses_repodata
 @lint_multiple_metas
 def in_other_channels(recipe, meta):
     """
     Does the package exist in any other non-bioconda channels?
     """
-    channels = set(utils.RepoData().get_package_data(
-        key="channel",
-        name=meta.get_value("package/name"),
-        version=meta.get_value("package/version")
-    ))
+    channels = _package_channels(recipe, meta)
     channels.discard('bioconda')
     if channels:
         return {
@@ -91,17 +260,13 @@ def in_other_channels(recipe, meta):
         }
 
 
+@uses_repodata
 @lint_multiple_metas
 def already_in_bioconda(recipe, meta):
     """
     Does the package exist in bioconda?
     """
-    channels = utils.RepoData().get_package_data(
-        key="channel",
-        name=meta.get_value("package/name"),
-        version=meta.get_value("package/version"),
-        build_number=meta.get_value("build/number", 0)
-    )
+    channels = _package_channels(recipe, meta, with_build_number=True)
 
     if 'bioconda' in channels:
         return {
@@ -137,12 +302,12 @@ def missing_license(recipe, meta):
         }
 
 
+@needs_render
 @lint_multiple_metas
 def missing_tests(recipe, meta):
     test_files = ['run_test.py', 'run_test.sh', 'run_test.pl']
     if not meta.get_section('test'):
-        if not any([os.path.exists(os.path.join(recipe, f)) for f in
-                    test_files]):
+        if not any(lint_context(recipe).exists(f) for f in test_files):
             return {
                 'no_tests': True,
                 'fix': 'add basic tests',
@@ -184,6 +349,7 @@ def uses_git_url(recipe, meta):
             }
 
 
+@needs_render
 @lint_multiple_metas
 def uses_perl_threaded(recipe, meta):
     if 'perl-threaded' in _get_deps(meta):
@@ -193,6 +359,7 @@ def uses_perl_threaded(recipe, meta):
         }
 
 
+@needs_render
 @lint_multiple_metas
 def uses_javajdk(recipe, meta):
     if 'java-jdk' in _get_deps(meta):
@@ -202,6 +369,7 @@ def uses_javajdk(recipe, meta):
         }
 
 
+@needs_render
 @lint_multiple_metas
 def uses_setuptools(recipe, meta):
     if 'setuptools' in _get_deps(meta, 'run'):
@@ -213,13 +381,14 @@ def uses_setuptools(recipe, meta):
 
 
 def has_windows_bat_file(recipe, metas):
-    if len(glob.glob(os.path.join(recipe, '*.bat'))) > 0:
+    if lint_context(recipe).glob('*.bat'):
         return {
             'bat_file': True,
             'fix': 'remove windows .bat files'
         }
 
 
+@needs_render
 @lint_multiple_metas
 def should_be_noarch(recipe, meta):
     deps = _get_deps(meta)
@@ -239,6 +408,7 @@ def should_be_noarch(recipe, meta):
         }
 
 
+@needs_render
 @lint_multiple_metas
 def should_not_be_noarch(recipe, meta):
     if (
@@ -256,6 +426,7 @@ def should_not_be_noarch(recipe, meta):
         }
 
 
+@needs_render
 @lint_multiple_metas
 def setup_py_install_args(recipe, meta):
     if 'setuptools' not in _get_deps(meta, 'build'):
@@ -274,11 +445,10 @@ def setup_py_install_args(recipe, meta):
     ):
         return err
 
-    build_sh = os.path.join(recipe, 'build.sh')
-    if not os.path.exists(build_sh):
+    contents = lint_context(recipe).read('build.sh')
+    if contents is None:
         return
 
-    contents = open(build_sh).read()
     if (
         'setup.py install' in contents and
         '--single-version-externally-managed' not in contents
@@ -305,12 +475,14 @@ def invalid_identifiers(recipe, meta):
         return
 
 
+NUMPY_XX_RE = re.compile(r'numpy( )+x\.x')
+
+
 def deprecated_numpy_spec(recipe, metas):
-    with open(os.path.join(recipe, "meta.yaml")) as recipe:
-        if re.search("numpy( )+x\.x", recipe.read()):
-            return {'deprecated_numpy_spec': True,
-                    'fix': 'omit x.x as pinning of numpy is now '
-                           'handled automatically'}
+    if NUMPY_XX_RE.search(lint_context(recipe).read('meta.yaml') or ''):
+        return {'deprecated_numpy_spec': True,
+                'fix': 'omit x.x as pinning of numpy is now '
+                       'handled automatically'}
 
 
 @lint_multiple_metas
@@ -329,6 +501,7 @@ def should_not_use_fn(recipe, meta):
             }
 
 
+@needs_render
 @lint_multiple_metas
 def should_use_compilers(recipe, meta):
     deps = _get_deps(meta)
@@ -345,6 +518,7 @@ def should_use_compilers(recipe, meta):
         }
 
 
+@needs_render
 @lint_multiple_metas
 def compilers_must_be_in_build(recipe, meta):
     if (
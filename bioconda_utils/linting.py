@@ -1,14 +1,24 @@
 import os
 import re
+import hashlib
+import inspect
 import itertools
-from collections import defaultdict, namedtuple
+import json
+import multiprocessing
+import pickle
+import sys
+import time
+from contextlib import contextmanager
+from collections import OrderedDict, defaultdict, namedtuple
 
 import pandas as pd
 import numpy as np
 import ruamel_yaml as yaml
+import conda_build.variants
 
 from . import utils
 from . import lint_functions
+from .recipe import Recipe
 
 import logging
 logger = logging.getLogger(__name__)
@@ -94,22 +104,91 @@ class LintArgs(namedtuple('LintArgs', (
         return super().__new__(cls, exclude, registry)
 
 
-def lint(recipes, lint_args):
+#: Conda build configs used to render recipes for linting, per process
+_lint_configs = None
+
+
+def _get_lint_configs():
+    """
+    Returns the conda build configs (linux and osx) used to render recipes.
+
+    The configs are loaded once per process instead of once per recipe.
     """
+    global _lint_configs
+    if _lint_configs is None:
+        _lint_configs = [
+            utils.load_conda_build_config(platform=platform, trim_skip=False)
+            for platform in ["linux", "osx"]
+        ]
+    return _lint_configs
+
+
+#: Combined conda build config (variant) files, per platform and process
+_variant_specs = {}
+
+#: Keys of conda build config files that are not variant dimensions
+_NON_VARIANT_KEYS = {
+    'zip_keys', 'extend_keys', 'pin_run_as_build', 'ignore_version',
+    'ignore_build_only_deps',
+}
+
+
+def _get_variant_spec(config):
+    """Returns the combined variant config files of **config**"""
+    if config.platform not in _variant_specs:
+        specs = OrderedDict(
+            (cfg.path, conda_build.variants.parse_config_file(cfg.path, config))
+            for cfg in utils.get_conda_build_config_files(config))
+        _variant_specs[config.platform] = conda_build.variants.combine_specs(
+            specs, log_output=False)
+    return _variant_specs[config.platform]
+
+
+def representative_variants(spec, used):
+    """
+    Reduces the variant matrix of **spec** to one representative variant
+    for each combination of the variant keys in **used**.
+
     Parameters
     ----------
 
-    recipes : list
-        List of recipes to lint
+    spec : dict
+        Combined conda build config
 
-    lint_args : LintArgs
+    used : set
+        Variant keys whose values may change the outcome of rendering the
+        recipe (e.g. those used in selectors)
+
+    Returns
+    -------
+    Dict of variant values to pass to conda-build, restricting all other
+    keys (and those zipped with them) to their first value.
     """
-    exclude = lint_args.exclude
-    registry = lint_args.registry
+    zip_keys = spec.get('zip_keys') or []
+    if zip_keys and isinstance(zip_keys[0], str):
+        zip_keys = [zip_keys]
+    keep = set(used)
+    for group in zip_keys:
+        if keep.intersection(group):
+            keep.update(group)
+
+    variants = {}
+    for key, values in spec.items():
+        if key in _NON_VARIANT_KEYS or key in keep:
+            continue
+        if isinstance(values, list) and len(values) > 1:
+            variants[key] = values[:1]
+    return variants
 
-    if registry is None:
-        registry = lint_functions.registry
 
+def get_skip_dict(recipes, exclude=None):
+    """
+    Collects the lint functions to skip for each recipe.
+
+    Skips are taken from the "[lint skip <function> for <recipe>]" directives
+    in the LINT_SKIP environment variable (or, if unset, the message of the
+    last commit) and from **exclude**, which applies to all recipes.
+    """
     skip_dict = defaultdict(list)
 
     commit_message = ""
@@ -138,68 +217,912 @@ def lint(recipes, lint_args):
     for func, recipe in to_skip:
         skip_dict[recipe].append(func)
 
+    return skip_dict
+
+
+class PackageMeta(namedtuple('PackageMeta', (
+    'output', 'package_name', 'version', 'build_number', 'skip_lints'
+))):
+    """
+    The parts of a rendered meta.yaml that lint functions using RepoData may
+    look at (see `lint_functions.uses_repodata`). Unlike the rendered
+    metadata, this is cheap to pass between processes.
+    """
+    _values = {
+        'package/name': 'package_name',
+        'package/version': 'version',
+        'build/number': 'build_number',
+        'extra/skip-lints': 'skip_lints',
+    }
+
+    @classmethod
+    def from_meta(cls, meta):
+        return cls(
+            output=meta.name(),
+            package_name=meta.get_value('package/name'),
+            version=meta.get_value('package/version'),
+            build_number=meta.get_value('build/number', 0),
+            skip_lints=tuple(meta.get_value('extra/skip-lints') or ()),
+        )
+
+    def name(self):
+        return self.output
+
+    def get_value(self, key, default=None):
+        value = getattr(self, self._values[key])
+        return default if value is None else value
+
+
+class RecipeMeta:
+    """
+    Stand-in for the conda-build metadata backed by the raw recipe as parsed
+    by `recipe.Recipe`, used by the fast lint tier.
+    """
+    def __init__(self, recipe):
+        self.recipe = recipe
+
+    def name(self):
+        return self.recipe.name
+
+    def get_section(self, section):
+        return self.recipe.meta.get(section) or {}
+
+    def get_value(self, path, default=None):
+        node = self.recipe.meta
+        for key in path.split('/'):
+            if isinstance(node, list):
+                # like conda-build, use the first entry of e.g. source lists
+                node = node[0] if node else {}
+            if not isinstance(node, dict) or key not in node:
+                return default
+            node = node[key]
+        return node
+
+
+def _load_raw_metas(recipe):
+    """
+    Parses the meta.yaml of **recipe** without conda-build.
+
+    Returns a list holding one `RecipeMeta`, or None if the recipe cannot be
+    parsed this way (e.g. due to duplicate keys from selectors).
+    """
+    try:
+        with open(os.path.join(recipe, 'meta.yaml')) as fin:
+            raw = Recipe(recipe, os.path.dirname(recipe)).load_from_string(fin.read())
+    except Exception as e:  # pylint: disable=broad-except
+        logger.debug('lint %s: cannot parse without rendering: %s', recipe, e)
+        return None
+    return [RecipeMeta(raw)]
+
+
+def _normalize_build_number(build_number):
+    try:
+        return int(build_number)
+    except (TypeError, ValueError):
+        return build_number
+
+
+class PackageChannels:
+    """
+    Channels containing the packages of all linted recipes.
+
+    Looks up all **packages** (`PackageMeta`) in `utils.RepoData` with one
+    merge, instead of filtering the channel data for each of them.
+    """
+    def __init__(self, packages):
+        keys = pd.DataFrame(
+            list({(pkg.package_name, str(pkg.version)) for pkg in packages}),
+            columns=['name', 'version'])
+        repodata = utils.RepoData().df[['name', 'version', 'build_number', 'channel']]
+        found = keys.merge(repodata, on=['name', 'version'])
+
+        self._by_version = defaultdict(set)
+        self._by_build = defaultdict(set)
+        for name, version, build_number, channel in found.itertuples(index=False):
+            self._by_version[(name, version)].add(channel)
+            self._by_build[(name, version, build_number)].add(channel)
+
+    def get(self, name, version, build_number=None):
+        """
+        Returns the set of channels containing package **name** in
+        **version** (and **build_number** if not None).
+        """
+        if build_number is None:
+            channels = self._by_version.get((name, str(version)), ())
+        else:
+            channels = self._by_build.get(
+                (name, str(version), _normalize_build_number(build_number)), ())
+        return set(channels)
+
+
+class LintProfile:
+    """
+    Wall time spent in the parts of a lint run.
+
+    Timings are recorded per **category** and **name**:
+
+    ``parse``
+        parsing a raw recipe in the fast lint tier (by recipe path)
+    ``render``
+        rendering a recipe with conda-build (by recipe path)
+    ``lint``
+        applying a lint function (by function name)
+    ``repodata``
+        loading and querying the channel data
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        #: Maps (category, name) to [number of calls, total seconds]
+        self.timings = {}
+
+    @contextmanager
+    def time(self, category, name):
+        """Context manager recording the time spent in its body"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(category, name, time.perf_counter() - start)
+
+    def add(self, category, name, seconds, calls=1):
+        entry = self.timings.setdefault((category, name), [0, 0.0])
+        entry[0] += calls
+        entry[1] += seconds
+
+    def merge(self, timings):
+        """Adds the **timings** of another profile (e.g. of a worker)"""
+        for (category, name), (calls, seconds) in timings.items():
+            self.add(category, name, seconds, calls)
+
+    def rows(self):
+        """Returns the timings as list of dicts, slowest first"""
+        rows = [{'category': category, 'name': name,
+                 'calls': calls, 'seconds': seconds}
+                for (category, name), (calls, seconds) in self.timings.items()]
+        return sorted(rows, key=lambda row: (-row['seconds'], row['category'],
+                                             row['name']))
+
+    def summary(self, top=10):
+        """
+        Returns a text summary: the total time per category followed by the
+        **top** slowest entries of each category.
+        """
+        rows = self.rows()
+        totals = defaultdict(float)
+        for row in rows:
+            totals[row['category']] += row['seconds']
+        lines = ['Total time per category:']
+        for category in sorted(totals, key=totals.get, reverse=True):
+            lines.append('  {:<10} {:10.3f}s'.format(category, totals[category]))
+        for category in sorted(totals, key=totals.get, reverse=True):
+            lines.append('Slowest in {}:'.format(category))
+            for row in [row for row in rows if row['category'] == category][:top]:
+                lines.append('  {:10.3f}s {:6d}x  {}'.format(
+                    row['seconds'], row['calls'], row['name']))
+        return '\n'.join(lines)
+
+    def dump(self, path):
+        """Writes the timings as JSON to **path**"""
+        with open(path, 'w') as fout:
+            json.dump(self.rows(), fout, indent=2)
+
+
+#: Used when a lint run is not profiled
+_NO_PROFILE = LintProfile(enabled=False)
+
+
+def _apply_registry(recipe, context, metas, registry, skips, persistent,
+                    profile=_NO_PROFILE):
+    """Applies the lint functions in **registry** not skipped for **recipe**"""
+    skip_for_this_recipe = set(skips).union(persistent)
+
     hits = []
-    for recipe in sorted(recipes):
+    for func in registry:
+        if func.__name__ in skip_for_this_recipe:
+            skip_sources = [
+                ('Commit message', skips),
+                ('skip-lints', persistent),
+            ]
+            for source, source_skips in skip_sources:
+                if func.__name__ not in source_skips:
+                    continue
+                logger.info(
+                    '%s defines skip lint test %s for recipe %s'
+                    % (source, func.__name__, recipe))
+            continue
+        with profile.time('lint', func.__name__):
+            result = func(context, metas)
+        if result:
+            hits.append(
+                {'recipe': recipe,
+                 'check': func.__name__,
+                 'info': result})
+    return hits
+
+
+def _render(recipe, context, full_matrix):
+    """Renders **recipe** for linux and osx"""
+    metas = []
+    for config in _get_lint_configs():
+        variants = None
+        if not full_matrix:
+            variants = representative_variants(
+                _get_variant_spec(config), context.variables)
+        metas.extend(utils.load_all_meta(recipe, config=config,
+                                         finalize=False, variants=variants))
+    return metas
+
+
+def _fast_registry(registry):
+    """
+    Returns the lint functions in **registry** that can be applied to the
+    raw recipe, i.e. those used by the fast lint tier.
+    """
+    return [func for func in registry
+            if not getattr(func, 'needs_render', False)
+            and not getattr(func, 'uses_repodata', False)]
+
+
+def lint_recipe(recipe, registry, skips=(), fast=False, full_matrix=False,
+                profile=_NO_PROFILE):
+    """
+    Applies the lint functions in **registry** to a single recipe.
+
+    Lint functions using RepoData are not applied here. Instead, the
+    rendered packages are returned so that they can be checked together
+    with those of the other recipes (see `lint_packages`).
+
+    Parameters
+    ----------
+
+    recipe : str
+        Path to the recipe
+
+    registry : list or tuple
+        Lint functions to apply
+
+    skips : list
+        Names of lint functions to skip for this recipe (in addition to those
+        listed in ``extra/skip-lints`` of the recipe)
+
+    fast : bool
+        If True, only lint functions marked neither with
+        `lint_functions.needs_render` nor with `lint_functions.uses_repodata`
+        are applied, to the raw recipe (see `RecipeMeta`). The others are
+        skipped. The recipe is only rendered with conda-build if it cannot be
+        parsed without rendering.
+
+    full_matrix : bool
+        If True, render all variants of the conda build config. Otherwise,
+        only one representative variant is rendered for each combination of
+        the variant keys used in selectors and Jinja2 conditions of the
+        recipe (see `representative_variants`), unless a lint function
+        marked with `lint_functions.needs_full_matrix` is to be applied.
+
+    profile : LintProfile
+        Records the time spent rendering and in each lint function
+
+    Returns
+    -------
+    Tuple of list of hits, each a dict with keys ``recipe``, ``check`` and
+    ``info``, and list of `PackageMeta` for the rendered packages.
+    """
+    if fast:
+        registry = _fast_registry(registry)
+
+    # The packages returned for lint functions using RepoData must include
+    # all outputs of the recipe, which requires rendering it.
+    repodata_registry = [func for func in registry
+                         if getattr(func, 'uses_repodata', False)]
+    registry = [func for func in registry if func not in repodata_registry]
+
+    raw_metas = None
+    if fast:
+        with profile.time('parse', recipe):
+            raw_metas = _load_raw_metas(recipe)
+    if raw_metas is None:
+        raw_registry = []
+    else:
+        raw_registry = [func for func in registry
+                        if not getattr(func, 'needs_render', False)]
+    render_registry = [func for func in registry if func not in raw_registry]
+
+    # lint functions share the files read from the recipe directory
+    context = lint_functions.LintContext(recipe)
+
+    full_matrix = full_matrix or any(
+        getattr(func, 'needs_full_matrix', False)
+        for func in render_registry + repodata_registry)
+
+    metas = raw_metas
+    if raw_metas is None or render_registry or repodata_registry:
         # Since lint functions need a parsed meta.yaml, checking for parsing
         # errors can't be a lint function.
         #
         # TODO: do we need a way to skip this the same way we can skip lint
-        # functions? I can't think of a reason we'd want to keep an unparseable
-        # YAML.
-        metas = []
+        # functions? I can't think of a reason we'd want to keep an
+        # unparseable YAML.
         try:
-            for platform in ["linux", "osx"]:
-                config = utils.load_conda_build_config(platform=platform, trim_skip=False)
-                metas.extend(utils.load_all_meta(recipe, config=config, finalize=False))
+            with profile.time('render', recipe):
+                metas = _render(recipe, context, full_matrix)
         except (
             yaml.scanner.ScannerError, yaml.constructor.ConstructorError
         ) as e:
             result = {'parse_error': str(e)}
-            hits.append(
-                {'recipe': recipe,
-                 'check': 'parse_error',
-                 'severity': 'ERROR',
-                 'info': result})
+            return [{'recipe': recipe,
+                     'check': 'parse_error',
+                     'severity': 'ERROR',
+                     'info': result}], []
+    logger.debug('lint {}'.format(recipe))
+
+    packages = [PackageMeta.from_meta(meta) for meta in metas]
+
+    # skips defined in meta.yaml
+    persistent = tuple(itertools.chain(*(pkg.skip_lints for pkg in packages)))
+
+    hits = []
+    if raw_registry:
+        hits.extend(_apply_registry(
+            recipe, context, raw_metas, raw_registry, skips, persistent, profile))
+    if render_registry:
+        hits.extend(_apply_registry(
+            recipe, context, metas, render_registry, skips, persistent, profile))
+    return hits, packages
+
+
+def lint_packages(recipe_packages, registry, skip_dict, profile=_NO_PROFILE):
+    """
+    Applies the lint functions using RepoData in **registry** to the
+    packages of all recipes at once.
+
+    Parameters
+    ----------
+
+    recipe_packages : dict
+        Maps recipe to list of `PackageMeta` as returned by `lint_recipe`
+
+    registry : list or tuple
+        Lint functions to apply (those not using RepoData are ignored)
+
+    skip_dict : dict
+        Maps recipe to names of lint functions to skip
+
+    profile : LintProfile
+        Records the time spent looking up the packages and in each lint
+        function
+
+    Returns
+    -------
+    Dict mapping recipe to list of hits
+    """
+    registry = [func for func in registry
+                if getattr(func, 'uses_repodata', False)]
+    if not registry or not recipe_packages:
+        return {}
+    with profile.time('repodata', 'merge'):
+        channels = PackageChannels(itertools.chain(*recipe_packages.values()))
+    results = {}
+    for recipe, packages in recipe_packages.items():
+        if not packages:
             continue
-        logger.debug('lint {}'.format(recipe))
+        context = lint_functions.LintContext(recipe, channels=channels)
+        persistent = tuple(itertools.chain(*(pkg.skip_lints for pkg in packages)))
+        results[recipe] = _apply_registry(
+            recipe, context, packages, registry,
+            skip_dict.get(recipe, ()), persistent, profile)
+    return results
+
 
-        # skips defined in commit message
-        skip_for_this_recipe = set(skip_dict[recipe])
+def _hash_recipe(recipe):
+    """Returns a hash over the names and contents of all files in **recipe**"""
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(recipe):
+        dirs.sort()
+        for fn in sorted(files):
+            path = os.path.join(root, fn)
+            digest.update(os.path.relpath(path, recipe).encode())
+            digest.update(b'\0')
+            with open(path, 'rb') as fin:
+                digest.update(fin.read())
+            digest.update(b'\0')
+    return digest.hexdigest()
 
-        # skips defined in meta.yaml
-        for meta in metas:
-            persistent = meta.get_value('extra/skip-lints', [])
-            skip_for_this_recipe.update(persistent)
 
+class LintCache:
+    """
+    Cache of lint results per recipe, stored as pickle in **path**.
+
+    For each recipe, the hits of the lint functions not using RepoData and
+    the rendered packages (`PackageMeta`) are cached. Lint functions using
+    RepoData are always applied again to the cached packages (see
+    `lint_packages`), so that updates of the channels do not invalidate the
+    cache.
+
+    The entry of a recipe is reused as long as none of the following change:
+
+    - the files in the recipe directory,
+    - the names and sources of the lint functions in **registry** (and the
+      sources of the modules defining them, which contain their helpers),
+    - the conda build config files used to render recipes,
+    - the skip directives for the recipe,
+    - whether the fast lint tier (**fast**) or the full variant matrix
+      (**full_matrix**) is used.
+    """
+    #: Changed whenever the format of the entries changes
+    FORMAT = b'2'
+
+    def __init__(self, path, registry, fast=False, full_matrix=False):
+        self.path = path
+        self.entries = {}
+        self.changed = False
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as fin:
+                    self.entries = pickle.load(fin)
+            except Exception:  # pylint: disable=broad-except
+                logger.warning('Ignoring unreadable lint cache %s', path)
+
+        digest = hashlib.sha256()
+        digest.update(self.FORMAT)
+        digest.update(b'fast' if fast else b'render')
+        digest.update(b'full' if full_matrix else b'representative')
+        modules = set()
         for func in registry:
-            if func.__name__ in skip_for_this_recipe:
-                skip_sources = [
-                    ('Commit message', skip_dict[recipe]),
-                    ('skip-lints', persistent),
-                ]
-                for source, skips in skip_sources:
-                    if func.__name__ not in skips:
-                        continue
-                    logger.info(
-                        '%s defines skip lint test %s for recipe %s'
-                        % (source, func.__name__, recipe))
-                continue
-            result = func(recipe, metas)
-            if result:
-                hits.append(
-                    {'recipe': recipe,
-                     'check': func.__name__,
-                     'info': result})
-
-    if hits:
+            digest.update(func.__name__.encode())
+            digest.update(inspect.getsource(func).encode())
+            modules.add(func.__module__)
+        sources = [inspect.getsourcefile(sys.modules[name])
+                   for name in sorted(modules)]
+        sources.extend(sorted(set(
+            cfg.path for config in _get_lint_configs()
+            for cfg in utils.get_conda_build_config_files(config))))
+        for source in sources:
+            with open(source, 'rb') as fin:
+                digest.update(fin.read())
+        self.registry_id = digest.hexdigest()
+
+    def _key(self, recipe, skips):
+        digest = hashlib.sha256()
+        digest.update(self.registry_id.encode())
+        digest.update(_hash_recipe(recipe).encode())
+        digest.update(repr(sorted(set(skips))).encode())
+        return digest.hexdigest()
+
+    def get(self, recipe, skips):
+        """
+        Returns the cached hits (of lint functions not using RepoData) and
+        packages of **recipe** as tuple, or None
+        """
+        entry = self.entries.get(recipe)
+        if entry is not None and entry[0] == self._key(recipe, skips):
+            return entry[1:]
+        return None
+
+    def set(self, recipe, skips, hits, packages):
+        """
+        Stores the **hits** (of lint functions not using RepoData) and
+        **packages** of **recipe**
+        """
+        self.entries[recipe] = (self._key(recipe, skips), hits, packages)
+        self.changed = True
+
+    def save(self):
+        """Writes the cache back to disk if it was modified"""
+        if not self.changed:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as fout:
+            pickle.dump(self.entries, fout)
+        os.replace(tmp, self.path)
+        self.changed = False
+
+
+#: Registry and skips of the lint run, inherited by forked lint workers
+_worker_args = None
+
+
+def _lint_worker(recipe):
+    registry, skip_dict, options, profiled = _worker_args
+    profile = LintProfile(enabled=profiled)
+    hits, packages = lint_recipe(recipe, registry, skip_dict.get(recipe, ()),
+                                 profile=profile, **options)
+    return hits, packages, profile.timings
+
+
+def _iter_lint_results(recipes, registry, skip_dict, jobs=1,
+                       profile=_NO_PROFILE, **options):
+    """
+    Yields the results of `lint_recipe` for each recipe in the order of
+    **recipes**, linting up to **jobs** recipes in parallel. The
+    **profile** and **options** are passed on to `lint_recipe`.
+    """
+    if jobs <= 1 or len(recipes) <= 1:
+        for recipe in recipes:
+            yield lint_recipe(recipe, registry, skip_dict.get(recipe, ()),
+                              profile=profile, **options)
+        return
+
+    # Load the configs before forking, so that the workers inherit them
+    # rather than each loading them again.
+    _get_lint_configs()
+
+    global _worker_args
+    _worker_args = (registry, skip_dict, options, profile.enabled)
+    try:
+        with multiprocessing.get_context('fork').Pool(jobs) as pool:
+            for hits, packages, timings in pool.imap(_lint_worker, recipes,
+                                                     chunksize=4):
+                profile.merge(timings)
+                yield hits, packages
+    finally:
+        _worker_args = None
+
+
+class LintReporter:
+    """
+    Receives the hits of a lint run as the recipes are linted.
+
+    Keeps a summary of the failed checks per recipe; subclasses decide what
+    to do with the hits themselves (see `DataFrameReporter` and
+    `StreamReporter`).
+    """
+    def __init__(self):
+        #: Maps recipe to list of names of failed checks
+        self.failed = OrderedDict()
+        #: Maps check name to its position in the registry
+        self.order = {}
+
+    def start(self, registry):
+        """Called at the beginning of a lint run with the lint functions"""
+        self.order = {func.__name__: n for n, func in enumerate(registry)}
+
+    def add(self, recipe, hits):
+        """
+        Called with (some of) the hits of **recipe**. Can be called more
+        than once per recipe, e.g. hits of lint functions using RepoData are
+        added after all recipes have been rendered.
+        """
+        for hit in hits:
+            checks = self.failed.setdefault(recipe, [])
+            if hit['check'] not in checks:
+                checks.append(hit['check'])
+        self.write(hits)
+
+    def write(self, hits):
+        """Handles the hits passed to `add`"""
+
+    def finish(self):
+        """Called at the end of the lint run"""
+
+    def report(self):
+        """Returns the result of `lint`"""
+        return None
+
+    def summary(self):
+        """
+        Returns a DataFrame with a ``failed_tests`` column indexed by recipe,
+        or None if no checks failed.
+        """
+        if not self.failed:
+            return None
+        recipes = sorted(self.failed)
+        failed_tests = pd.Series(
+            [sorted(self.failed[recipe], key=lambda check: self.order.get(check, -1))
+             for recipe in recipes],
+            index=pd.Index(recipes, name='recipe'))
+        return pd.DataFrame(dict(failed_tests=failed_tests))
+
+
+class DataFrameReporter(LintReporter):
+    """
+    Collects all hits into a DataFrame with one row per hit, with the
+    ``info`` dicts expanded into additional columns.
+    """
+    def __init__(self):
+        super().__init__()
+        self.hits = []
+
+    def write(self, hits):
+        self.hits.extend(hits)
+
+    def report(self):
+        if not self.hits:
+            return None
+        hits = sorted(self.hits, key=lambda hit: (
+            hit['recipe'], self.order.get(hit['check'], -1)))
         report = pd.DataFrame(hits)[['recipe', 'check', 'info']]
 
         # expand out the info into more columns
         info = pd.DataFrame(list(report['info'].values))
         report = pd.concat((report, info), axis=1)
         return report
-    else:
-        return
+
+
+def _json_default(obj):
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    return str(obj)
+
+
+class StreamReporter(LintReporter):
+    """
+    Writes each hit to **stream** as soon as it is known, in format **fmt**:
+
+    ``jsonl``
+        One JSON object per line with keys ``recipe``, ``check`` and
+        ``info``.
+
+    ``tsv``
+        Tab separated columns ``recipe``, ``check`` and ``info``, the latter
+        JSON encoded. The first line is a header.
+    """
+    formats = ('jsonl', 'tsv')
+
+    def __init__(self, stream, fmt='jsonl'):
+        super().__init__()
+        if fmt not in self.formats:
+            raise ValueError('Unknown lint report format {}'.format(fmt))
+        self.stream = stream
+        self.fmt = fmt
+
+    def start(self, registry):
+        super().start(registry)
+        if self.fmt == 'tsv':
+            self.stream.write('recipe\tcheck\tinfo\n')
+
+    def write(self, hits):
+        for hit in hits:
+            row = OrderedDict((key, hit[key]) for key in ('recipe', 'check', 'info'))
+            if self.fmt == 'tsv':
+                row['info'] = json.dumps(row['info'], default=_json_default)
+                self.stream.write('\t'.join(row.values()) + '\n')
+            else:
+                self.stream.write(json.dumps(row, default=_json_default) + '\n')
+        self.stream.flush()
+
+
+def lint(recipes, lint_args, jobs=1, cache=None, fast=False, full_matrix=False,
+         reporter=None, profile=None, skip_dict=None):
+    """
+    Parameters
+    ----------
+
+    recipes : list
+        List of recipes to lint
+
+    lint_args : LintArgs
+
+    jobs : int
+        Number of recipes to lint in parallel processes. The report does not
+        depend on this setting.
+
+    cache : str or None
+        If not None, path to a file caching the hits and rendered packages
+        of each recipe between runs (see `LintCache`). Only recipes for which
+        the cached results are out of date are rendered and linted. Lint
+        functions using RepoData are applied to all recipes.
+
+    fast : bool
+        If True, only lint functions that need neither the variants rendered
+        by conda-build nor the channel data are applied, to the raw recipe
+        (see `lint_recipe`).
+
+    full_matrix : bool
+        If True, render all variants of the conda build config instead of
+        one representative variant for each combination of the variant keys
+        used in selectors and Jinja2 conditions (see `lint_recipe`).
+
+    reporter : LintReporter or None
+        Receives the hits as recipes are linted. Defaults to a
+        `DataFrameReporter`.
+
+    profile : LintProfile or None
+        If not None, records the time spent rendering recipes, in each lint
+        function and loading and querying the channel data.
+
+    skip_dict : dict or None
+        Maps recipe to names of lint functions to skip, as returned by
+        `get_skip_dict`. Computed from **lint_args** if None.
+
+    Returns
+    -------
+    The result of ``reporter.report()``, i.e. by default a DataFrame with
+    one row per hit, or None if there were none.
+    """
+    exclude = lint_args.exclude
+    registry = lint_args.registry
+
+    if registry is None:
+        registry = lint_functions.registry
+    if fast:
+        registry = _fast_registry(registry)
+
+    if reporter is None:
+        reporter = DataFrameReporter()
+    reporter.start(registry)
+    if profile is None:
+        profile = _NO_PROFILE
+
+    recipes = sorted(recipes)
+    if skip_dict is None:
+        skip_dict = get_skip_dict(recipes, exclude)
+
+    if recipes and any(getattr(func, 'uses_repodata', False) for func in registry):
+        with profile.time('repodata', 'load'):
+            utils.RepoData().df  # pylint: disable=expression-not-assigned
+
+    todo = recipes
+    lint_cache = None
+    recipe_packages = {}
+    if cache is not None:
+        lint_cache = LintCache(cache, registry, fast, full_matrix)
+        todo = []
+        for recipe in recipes:
+            cached = lint_cache.get(recipe, skip_dict.get(recipe, ()))
+            if cached is None:
+                todo.append(recipe)
+            else:
+                recipe_hits, recipe_packages[recipe] = cached
+                reporter.add(recipe, recipe_hits)
+        logger.info('Using cached lint results for %s of %s recipes',
+                    len(recipes) - len(todo), len(recipes))
+
+    for recipe, (recipe_hits, packages) in zip(
+            todo, _iter_lint_results(todo, registry, skip_dict, jobs,
+                                     profile=profile, fast=fast,
+                                     full_matrix=full_matrix)):
+        reporter.add(recipe, recipe_hits)
+        recipe_packages[recipe] = packages
+        if lint_cache is not None:
+            lint_cache.set(recipe, skip_dict.get(recipe, ()), recipe_hits, packages)
+    if lint_cache is not None:
+        lint_cache.save()
+
+    # Checks against the channel data are done for all recipes at once,
+    # including those with cached results
+    repodata_hits = lint_packages(recipe_packages, registry, skip_dict, profile)
+    for recipe in recipes:
+        if repodata_hits.get(recipe):
+            reporter.add(recipe, repodata_hits[recipe])
+
+    reporter.finish()
+    return reporter.report()
+
+
+def _mtime(path):
+    """Returns the modification time of **path** in ns, or None if missing"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _recipe_signature(recipe):
+    """
+    Returns the modification times of the directory of **recipe** (changed
+    when files are added, removed or replaced) and of the files in it (changed
+    when they are edited in place)
+    """
+    try:
+        files = sorted((entry.name, entry.stat().st_mtime_ns)
+                       for entry in os.scandir(recipe) if entry.is_file())
+    except FileNotFoundError:
+        files = []
+    return _mtime(recipe), tuple(files)
+
+
+class RecipeWatcher:
+    """
+    Polls **recipe_folder** for recipes (matching **packages**) that have
+    been added or modified.
+
+    To keep polls cheap, only the directory of each recipe and the files
+    directly in it are checked. The recipe folder is only searched for new
+    recipes if one of the directories that may contain them (the recipe
+    folder, its subdirectories and the parents of recipes) changed.
+    """
+    def __init__(self, recipe_folder, packages="*"):
+        self.recipe_folder = recipe_folder
+        self.packages = packages
+        #: Maps recipe to its signature (see `_recipe_signature`)
+        self.signatures = {}
+        #: Maps directories that may contain new recipes to their mtime
+        self.folders = {}
+        self._find_recipes()
+        for recipe in self.signatures:
+            self.signatures[recipe] = _recipe_signature(recipe)
+
+    def _find_recipes(self):
+        recipes = list(utils.get_recipes(self.recipe_folder, self.packages))
+        folders = {self.recipe_folder}
+        folders.update(entry.path for entry in os.scandir(self.recipe_folder)
+                       if entry.is_dir())
+        for recipe in recipes:
+            parent = os.path.dirname(recipe)
+            while parent not in folders and parent.startswith(self.recipe_folder):
+                folders.add(parent)
+                parent = os.path.dirname(parent)
+        self.folders = {folder: _mtime(folder) for folder in folders}
+        self.signatures = {recipe: self.signatures.get(recipe)
+                           for recipe in recipes}
+
+    def poll(self):
+        """Returns the sorted list of recipes changed since the last call"""
+        if any(_mtime(folder) != mtime for folder, mtime in self.folders.items()):
+            self._find_recipes()
+        changed = []
+        for recipe, old_signature in self.signatures.items():
+            signature = _recipe_signature(recipe)
+            if signature != old_signature:  # also if new (no old signature)
+                self.signatures[recipe] = signature
+                changed.append(recipe)
+        return sorted(changed)
+
+
+def watch(recipe_folder, lint_args, packages="*", interval=1.0, **kwargs):
+    """
+    Lints the recipes in **recipe_folder** whenever their files change,
+    until interrupted.
+
+    The conda build configs, the channel data and the lint functions to
+    skip for each recipe are loaded once up front, so that only the changed
+    recipes have to be rendered and linted after each change. Skip
+    directives in the commit message are therefore only read at the start.
+
+    Parameters
+    ----------
+
+    recipe_folder : str
+        Top-level dir of the recipes
+
+    lint_args : LintArgs
+
+    packages : str or list
+        Glob(s) restricting the recipes to watch
+
+    interval : float
+        Seconds between polls of the recipe folder
+
+    kwargs :
+        Passed on to `lint`
+    """
+    registry = lint_args.registry or lint_functions.registry
+    _get_lint_configs()
+    if any(getattr(func, 'uses_repodata', False) for func in registry):
+        utils.RepoData().df  # pylint: disable=expression-not-assigned
+
+    watcher = RecipeWatcher(recipe_folder, packages)
+    skip_dict = get_skip_dict(list(watcher.signatures), lint_args.exclude)
+    known = set(watcher.signatures)
+    logger.info('Watching %s recipes in %s for changes',
+                len(watcher.signatures), recipe_folder)
+    while True:
+        time.sleep(interval)
+        changed = watcher.poll()
+        if not changed:
+            continue
+        for recipe in changed:
+            if recipe not in known:
+                known.add(recipe)
+                skip_dict[recipe].extend(lint_args.exclude or ())
+        reporter = DataFrameReporter()
+        try:
+            lint(changed, lint_args, reporter=reporter, skip_dict=skip_dict,
+                 **kwargs)
+        except Exception:  # pylint: disable=broad-except
+            # e.g. recipes saved half-way; keep watching
+            logger.exception('Linting %s failed', ', '.join(changed))
+            continue
+        summary = reporter.summary()
+        for recipe in changed:
+            if summary is not None and recipe in summary.index:
+                logger.error('%s failed linting: %s', recipe,
+                             ', '.join(summary.loc[recipe, 'failed_tests']))
+            else:
+                logger.info('%s passed linting', recipe)
 
 
 def markdown_report(report=None):
@@ -1,12 +1,13 @@
 import subprocess as sp
 import tempfile
-import tarfile
 import os
 import shlex
 from shutil import which
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
 from . import utils
+from . import index
 
 from conda_build.metadata import MetaData
 
@@ -17,17 +18,50 @@ logger = logging.getLogger(__name__)
 # TODO: Make this configurable in bioconda_utils.build and bioconda_utils.cli.
 MULLED_CONDA_IMAGE = "continuumio/miniconda3:4.3.27"
 
+# Conda only understands the .conda package format since version 4.7
+MULLED_CONDA_IMAGE_V2 = "continuumio/miniconda3:4.7.10"
+
+#: Default number of mulled-build tests `test_packages` runs concurrently
+MAX_PARALLEL_TESTS = 4
+
+
+#: Tests parsed by `get_tests`, keyed by package file fingerprint
+_tests_cache = {}
+
+
+def _extract_recipe(path, dest):
+    """Write the ``info/recipe`` folder of package **path** to **dest**"""
+    prefix = 'info/recipe/'
+    for name, content in utils.iter_package_info(path):
+        if not name.startswith(prefix):
+            continue
+        target = os.path.normpath(os.path.join(dest, name[len(prefix):]))
+        if not target.startswith(os.path.join(dest, '')):
+            raise ValueError('{}: invalid member {}'.format(path, name))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as fout:
+            fout.write(content)
+
 
 def get_tests(path):
-    "Extract tests from a built package"
-    tmp = tempfile.mkdtemp()
-    t = tarfile.open(path)
-    t.extractall(tmp)
-    input_dir = os.path.join(tmp, 'info', 'recipe')
+    """
+    Extract tests from a built package
 
-    tests = []
-    recipe_meta = MetaData(input_dir)
+    Only the ``info/recipe`` files are read from the package (streaming, no
+    full extraction). Results are cached per package file (path, size and
+    modification time), so testing the same package again is free.
+    """
+    stat = os.stat(path)
+    key = (os.path.realpath(path), stat.st_size, stat.st_mtime)
+    if key not in _tests_cache:
+        with tempfile.TemporaryDirectory() as tmp:
+            _extract_recipe(path, tmp)
+            _tests_cache[key] = _tests_from_recipe(MetaData(tmp))
+    return _tests_cache[key]
 
+
+def _tests_from_recipe(recipe_meta):
+    tests = []
     tests_commands = recipe_meta.get_value('test/commands')
     tests_imports = recipe_meta.get_value('test/imports')
     requirements = recipe_meta.get_value('requirements/run')
@@ -65,12 +99,10 @@ def get_image_name(path):
     ----------
 
     path : str
-        Path to .tar.by2 package build by conda-build
+        Path to .tar.bz2 or .conda package build by conda-build
 
     """
-    assert path.endswith('.tar.bz2')
-
-    pkg = os.path.basename(path).replace('.tar.bz2', '')
+    pkg = utils.package_dist_name(path)
     toks = pkg.split('-')
     build_string = toks[-1]
     version = toks[-2]
@@ -86,7 +118,9 @@ def test_package(
     channels=("conda-forge", "local", "bioconda", "defaults"),
     mulled_args="",
     base_image=None,
-    conda_image=MULLED_CONDA_IMAGE,
+    conda_image=None,
+    logfile=None,
+    reindex=True,
 ):
     """
     Tests a built package in a minimal docker container.
@@ -94,7 +128,7 @@ def test_package(
     Parameters
     ----------
     path : str
-        Path to a .tar.bz2 package built by conda-build
+        Path to a .tar.bz2 or .conda package built by conda-build
 
     name_override : str
         Passed as the --name-override argument to mulled-build
@@ -113,17 +147,25 @@ def test_package(
 
     conda_image : None | str
         Conda Docker image to install the package with during the mulled based
-        tests.
+        tests. Defaults to MULLED_CONDA_IMAGE, or MULLED_CONDA_IMAGE_V2 for
+        .conda packages.
+
+    logfile : None | str
+        If given, the complete mulled-build output is written gzip compressed
+        to this file. Only the tail of the output is kept in memory.
+
+    reindex : bool
+        Update the index of the local channel before testing. Can be disabled
+        if the caller has already done so (see `test_packages`).
     """
 
-    assert path.endswith('.tar.bz2'), "Unrecognized path {0}".format(path)
+    assert path.endswith(utils.PACKAGE_EXTENSIONS), "Unrecognized path {0}".format(path)
     # assert os.path.exists(path), '{0} does not exist'.format(path)
 
     conda_bld_dir = os.path.abspath(os.path.dirname(os.path.dirname(path)))
 
-    sp.check_call([utils.bin_for('conda'), 'index', os.path.dirname(path)])
-    # always build noarch index to make conda happy
-    sp.check_call([utils.bin_for('conda'), 'index', os.path.join(conda_bld_dir, "noarch")])
+    if reindex:
+        index.update_channel_index([path])
 
     spec = get_image_name(path)
 
@@ -159,12 +201,63 @@ def test_package(
 
     logger.debug('mulled-build command: %s' % cmd)
 
+    if conda_image is None:
+        if path.endswith('.conda'):
+            conda_image = MULLED_CONDA_IMAGE_V2
+        else:
+            conda_image = MULLED_CONDA_IMAGE
+
     env = os.environ.copy()
     if base_image is not None:
         env["DEST_BASE_IMAGE"] = base_image
     env["CONDA_IMAGE"] = conda_image
     with tempfile.TemporaryDirectory() as d:
         with utils.Progress():
-            p = utils.run(cmd, env=env, cwd=d, mask=False)
+            p = utils.run(cmd, env=env, cwd=d, mask=False,
+                          stream=True, logfile=logfile)
 
     return p
+
+
+def test_packages(paths, logfiles=None, max_workers=MAX_PARALLEL_TESTS, **kwargs):
+    """
+    Tests several built packages, e.g. all outputs of a recipe.
+
+    The local channel is indexed once for the whole batch and the mulled-build
+    tests are run concurrently. Each package still gets its own test image,
+    so that images can be uploaded per package.
+
+    Parameters
+    ----------
+    paths : list
+        Paths to packages built by conda-build
+
+    logfiles : None | dict
+        Maps package paths to log files (see `test_package`)
+
+    max_workers : int
+        Maximum number of mulled-build tests run at the same time
+
+    kwargs
+        Passed on to `test_package`
+
+    Returns
+    -------
+    Dictionary mapping each package path to None if the test passed or to
+    the subprocess.CalledProcessError raised if it failed.
+    """
+    if not paths:
+        return {}
+    if logfiles is None:
+        logfiles = {}
+    index.update_channel_index(paths)
+
+    def run_test(path):
+        try:
+            test_package(path, logfile=logfiles.get(path), reindex=False, **kwargs)
+        except sp.CalledProcessError as e:
+            return e
+        return None
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(paths))) as executor:
+        return dict(zip(paths, executor.map(run_test, paths)))
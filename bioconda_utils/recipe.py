@@ -8,6 +8,7 @@ edit the meta.yaml.
 import logging
 import os
 import re
+import threading
 
 from collections import defaultdict
 from copy import copy
@@ -16,26 +17,86 @@ from typing import Any, Dict, List, Sequence, Optional, Pattern
 
 try:
     from ruamel.yaml import YAML
+    from ruamel.yaml.comments import CommentedMap, CommentedSeq
     from ruamel.yaml.constructor import DuplicateKeyError
 except ModuleNotFoundError:
     from ruamel_yaml import YAML
+    from ruamel_yaml.comments import CommentedMap, CommentedSeq
     from ruamel_yaml.constructor import DuplicateKeyError
 
 from . import utils
 from .async import EndProcessingItem
 
 
-yaml = YAML(typ="rt")  # pylint: disable=invalid-name
+def _make_yaml() -> YAML:
+    """Creates round trip YAML parser"""
+    parser = YAML(typ="rt")
+    # Hack: mirror stringify from conda-build in removing implicit
+    #       resolution of numbers
+    for digit in '0123456789':
+        if digit in parser.resolver.versioned_resolver:
+            del parser.resolver.versioned_resolver[digit]
+    return parser
+
+
+yaml = _make_yaml()  # pylint: disable=invalid-name
+
+#: ruamel's YAML instances keep parser state, threads need their own
+_thread_local = threading.local()  # pylint: disable=invalid-name
+
+
+def _get_yaml() -> YAML:
+    """Returns YAML parser for current thread"""
+    if threading.current_thread() is threading.main_thread():
+        return yaml
+    if not hasattr(_thread_local, "yaml"):
+        _thread_local.yaml = _make_yaml()
+    return _thread_local.yaml
 
-# Hack: mirror stringify from conda-build in removing implicit
-#       resolution of numbers
-for digit in '0123456789':
-    if digit in yaml.resolver.versioned_resolver:
-        del yaml.resolver.versioned_resolver[digit]
 
 logger = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
 
+def _compact_yaml(node: Any) -> Any:
+    """Converts round trip YAML **node** into nested tuples
+
+    Only the data and the line/column information used by `Recipe` are
+    kept (no comments), which makes the result much cheaper to pickle
+    than ruamel's objects. Scalars never load as tuples, so tuples mark
+    mappings and sequences.
+    """
+    if isinstance(node, CommentedMap):
+        return ("map", node.lc.line, node.lc.col,
+                [(key, node.lc.data.get(key), _compact_yaml(value))
+                 for key, value in node.items()])
+    if isinstance(node, CommentedSeq):
+        return ("seq", node.lc.line, node.lc.col,
+                [(node.lc.data.get(idx), _compact_yaml(value))
+                 for idx, value in enumerate(node)])
+    return node
+
+
+def _expand_yaml(node: Any) -> Any:
+    """Restores YAML data converted by `_compact_yaml`"""
+    if not isinstance(node, tuple):
+        return node
+    kind, line, col, items = node
+    if kind == "map":
+        result = CommentedMap()
+        for key, pos, value in items:
+            result[key] = _expand_yaml(value)
+            if pos is not None:
+                result.lc.add_kv_line_col(key, pos)
+    else:
+        result = CommentedSeq()
+        for idx, (pos, value) in enumerate(items):
+            result.append(_expand_yaml(value))
+            if pos is not None:
+                result.lc.add_kv_line_col(idx, pos)
+    result.lc.line, result.lc.col = line, col
+    return result
+
+
 class RecipeError(EndProcessingItem):
     pass
 
@@ -150,6 +211,12 @@ class Recipe():
         self.render()
         return self
 
+    def load_from_compact(self, data: str, compact_meta: Any) -> "Recipe":
+        """Load recipe contents **data** parsed by `parse_compact`"""
+        self.meta_yaml = data.splitlines()
+        self.meta = _expand_yaml(compact_meta)
+        return self
+
     def set_original(self) -> None:
         """Store the current state of the recipe as "original" version"""
         self.orig = copy(self)
@@ -240,7 +307,7 @@ class Recipe():
         """
         yaml_text = self.get_template().render(self.JINJA_VARS)
         try:
-            self.meta = yaml.load(yaml_text)
+            self.meta = _get_yaml().load(yaml_text)
         except DuplicateKeyError as err:
             logger.debug("fixing duplicate key at %i:%i",
                          err.context_mark.line, err.context_mark.column)
@@ -249,7 +316,7 @@ class Recipe():
                                                      err.context_mark.column)
             if yaml_text:
                 try:
-                    self.meta = yaml.load(yaml_text)
+                    self.meta = _get_yaml().load(yaml_text)
                 except DuplicateKeyError:
                     raise DuplicateKey(self)
             else:
@@ -442,3 +509,15 @@ class Recipe():
             lines.append(self.meta_yaml[row])
         lines.append(self.meta_yaml[end_row][:end_col])
         return "\n".join(lines).strip()
+
+
+def parse_compact(recipe_dir: str, recipe_folder: str, data: str) -> Any:
+    """Parse recipe contents **data** into a compact representation
+
+    Meant to be run in a worker process: Only the recipe location and
+    text are sent to the worker, and only the parsed data, as nested
+    tuples, is sent back. Pass the result to `Recipe.load_from_compact`.
+    """
+    recipe = Recipe(recipe_dir, recipe_folder)
+    recipe.load_from_string(data)
+    return _compact_yaml(recipe.meta)
@@ -68,8 +68,9 @@ from pkg_resources import parse_version
 
 from . import utils
 from .utils import ensure_list
-from .recipe import Recipe
-from .async import AsyncFilter, AsyncPipeline, AsyncRequests, EndProcessingItem, EndProcessing
+from .recipe import Recipe, parse_compact
+from .async import (AsyncFilter, AsyncPipeline, AsyncRequests, EndProcessingItem, EndProcessing,
+                    HostUnavailable, KnownFailure)
 
 if TYPE_CHECKING:
     from .githandler import GitHandler
@@ -92,11 +93,18 @@ class Scanner(AsyncPipeline[Recipe]):
       recipe_folder: location of recipe directories
       packages: glob pattern to select recipes
       config: config.yaml (unused)
+      cache_fn: filename for debug cache of URL contents and checksums
+      http_cache_fn: filename for HTTP cache revalidated across runs
+      io_workers: number of threads for blocking io
+      proc_workers: number of processes for CPU bound work
+      parse_in_threads: parse recipes in io threads instead of processes
     """
     def __init__(self, recipe_folder: str, packages: List[str],
                  cache_fn: str = None, max_inflight: int = 100,
-                 status_fn: str = None) -> None:
-        super().__init__(max_inflight)
+                 status_fn: str = None, http_cache_fn: str = None,
+                 io_workers: Optional[int] = None, proc_workers: Optional[int] = None,
+                 parse_in_threads: bool = False) -> None:
+        super().__init__(max_inflight, io_workers, proc_workers)
         #: folder containing recipes
         self.recipe_folder: str = recipe_folder
         #: glob expressions
@@ -108,7 +116,9 @@ class Scanner(AsyncPipeline[Recipe]):
         #: filename to write statuses to
         self.status_fn: str = status_fn
         #: async requests helper
-        self.req = AsyncRequests(cache_fn)
+        self.req = AsyncRequests(cache_fn, http_cache_fn)
+        #: parse recipes in threads (avoids pickling, but holds the GIL)
+        self.parse_in_threads = parse_in_threads
 
     def run(self) -> bool:
         """Runs scanner"""
@@ -128,9 +138,24 @@ class Scanner(AsyncPipeline[Recipe]):
         """Return initial iterator over stub (unloaded) Recipes"""
         recipes = list(utils.get_recipes(self.recipe_folder, self.packages))
         random.shuffle(recipes)
+        self.num_items = len(recipes)
         return (Recipe(recipe_dir, self.recipe_folder)
                 for recipe_dir in recipes)
 
+    async def load_recipe(self, recipe: Recipe, recipe_text: str) -> Recipe:
+        """Parses **recipe_text** into **recipe** in process or thread pool
+
+        Parsing in the process pool only passes the recipe location and text
+        to the worker and a compact form of the parsed data back, rather than
+        pickling the `Recipe` in both directions.
+        """
+        if self.parse_in_threads:
+            return await self.run_io(recipe.load_from_string, recipe_text)
+        compact_meta = await self.run_sp(
+            parse_compact, os.path.join(recipe.basedir, recipe.reldir),
+            recipe.basedir, recipe_text)
+        return recipe.load_from_compact(recipe_text, compact_meta)
+
     async def _async_run(self) -> bool:
         """Runner within async loop"""
         async with self.req:
@@ -411,8 +436,10 @@ class UpdateVersion(Filter):
                 for match in versions:
                     match['hoster'] = hoster
                     version_map[match["version"]][url] = match
-            except ClientResponseError as exc:
-                logger.debug("HTTP %s when getting %s", exc, url)
+            except (ClientResponseError, KnownFailure) as exc:
+                logger.debug("HTTP %s when getting %s", exc.code, url)
+            except HostUnavailable as exc:
+                logger.debug("Host %s unavailable when getting %s", exc, url)
 
         if not version_map:
             raise self.NoRecognizedSourceUrl(recipe, source_idx+1)
@@ -535,6 +562,9 @@ class UpdateChecksums(Filter):
         """The checksum did not change after version bump"""
         template = "had no change to checksum after update?!"
 
+    #: downloading source tarballs is expensive, limit concurrent recipes
+    max_concurrency = 20
+
     def __init__(self, scanner: Scanner,
                  failed_file: Optional[str] = None) -> None:
         super().__init__(scanner)
@@ -592,10 +622,14 @@ class UpdateChecksums(Filter):
                     await self.pipeline.req.get_checksum_from_url(
                         url, f"{recipe} [{source_idx}.{url_idx}]")
                 )
-            except ClientResponseError as exc:
+            except (ClientResponseError, KnownFailure) as exc:
                 logger.info("Recipe %s: HTTP %s while downloading url %i",
                             recipe, exc.code, url_idx)
                 self.failed_urls += ["\t".join((str(exc.code), url))]
+            except HostUnavailable as exc:
+                logger.info("Recipe %s: host %s unavailable for url %i",
+                            recipe, exc, url_idx)
+                self.failed_urls += ["\t".join(("unavailable", url))]
 
         if not new_checksums:
             raise self.NoValidUrls(recipe, source_idx)
@@ -673,7 +707,7 @@ class LoadRecipe(Filter):
         async with self.sem, \
                    aiofiles.open(recipe.path, encoding="utf-8") as fdes:
             recipe_text = await fdes.read()
-        recipe = await self.pipeline.run_sp(recipe.load_from_string, recipe_text)
+        recipe = await self.pipeline.load_recipe(recipe, recipe_text)
         recipe.set_original()
         return recipe
 
@@ -707,7 +741,7 @@ class GitLoadRecipe(GitFilter):
         logger.debug("Recipe %s: loading from master", recipe)
         recipe_text = await self.pipeline.run_io(self.git.read_from_branch,
                                                  self.git.master, recipe.path)
-        recipe = await self.pipeline.run_sp(recipe.load_from_string, recipe_text)
+        recipe = await self.pipeline.load_recipe(recipe, recipe_text)
         recipe.set_original()
 
         if remote_branch:
@@ -715,14 +749,16 @@ class GitLoadRecipe(GitFilter):
                 logger.info("Recipe %s: updating from remote %s", recipe, branch_name)
                 recipe_text = await self.pipeline.run_io(self.git.read_from_branch,
                                                          remote_branch, recipe.path)
-                recipe = await self.pipeline.run_sp(recipe.load_from_string, recipe_text)
-                await self.pipeline.run_io(self.git.create_local_branch, branch_name)
+                recipe = await self.pipeline.load_recipe(recipe, recipe_text)
+                async with self.git.lock_branches:
+                    await self.pipeline.run_io(self.git.create_local_branch, branch_name)
                 recipe.on_branch = True
             else:
                 # Note: If a PR still exists for this, it is silently closed by deleting
                 #       the branch.
                 logger.info("Recipe %s: deleting outdated remote %s", recipe, branch_name)
-                await self.pipeline.run_io(self.git.delete_remote_branch, branch_name)
+                async with self.git.lock_branches:
+                    await self.pipeline.run_io(self.git.delete_remote_branch, branch_name)
         return recipe
 
 
@@ -1,9 +1,26 @@
 import os
 import subprocess as sp
 import logging
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import backoff
+import requests
+
 from . import utils
 logger = logging.getLogger(__name__)
 
+#: anaconda.org API endpoint describing a single package file
+ANACONDA_DIST_URL = ('https://api.anaconda.org/dist/{channel}/{name}/{version}/'
+                     '{subdir}/{fn}')
+
+#: Default number of concurrent uploads
+MAX_WORKERS = 4
+
+#: Default number of attempts for each upload
+MAX_TRIES = 3
+
 
 def anaconda_upload(package, token=None, label=None):
     """
@@ -12,7 +29,7 @@ def anaconda_upload(package, token=None, label=None):
     Parameters
     ----------
     package : str
-        Filename to built package
+        Filename to built package (.tar.bz2 or .conda)
 
     token : str
         If None, use the environment variable ANACONDA_TOKEN, otherwise, use
@@ -69,3 +86,140 @@ def mulled_upload(image, quay_target):
         cmd.extend(['--oauth-token', token])
         mask = [token]
     return utils.run(cmd, mask=mask)
+
+
+def remote_md5(package, channel):
+    """
+    Returns the md5 checksum anaconda.org reports for **package** in
+    **channel**, or None if the file does not exist there (or the API
+    could not be reached or returned an unexpected response).
+    """
+    record = None
+    for _, content in utils.iter_package_info(package, names=['info/index.json']):
+        record = json.loads(content.decode())
+    if record is None:
+        return None
+    subdir = os.path.basename(os.path.dirname(os.path.abspath(package)))
+    url = ANACONDA_DIST_URL.format(
+        channel=channel, name=record['name'], version=record['version'],
+        subdir=subdir, fn=os.path.basename(package))
+    try:
+        resp = requests.get(url, timeout=30)
+    except requests.RequestException as e:
+        logger.debug('UPLOAD: could not query %s: %s', url, e)
+        return None
+    if resp.status_code != 200:
+        return None
+    try:
+        payload = resp.json()
+    except ValueError as e:
+        logger.debug('UPLOAD: unexpected response from %s: %s', url, e)
+        return None
+    if not isinstance(payload, dict):
+        return None
+    return payload.get('md5')
+
+
+def local_md5(package):
+    """Returns the md5 checksum of the file **package**"""
+    md5 = hashlib.md5()
+    with open(package, 'rb') as fin:
+        for block in iter(lambda: fin.read(1024 * 1024), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+class UploadManager:
+    """
+    Uploads packages to anaconda.org and images to quay.io concurrently.
+
+    Uploads are submitted with `upload_package` and `upload_image` and run in
+    the background (at most **max_workers** at a time), so they can overlap
+    with building the next recipes. Failed uploads are retried with
+    exponential backoff up to **max_tries** times. Packages whose checksum
+    already matches the file in **channel** on anaconda.org are skipped.
+
+    Use as context manager or call `wait` to obtain the list of packages and
+    images that could not be uploaded.
+
+    Parameters
+    ----------
+    label : str
+        Optional label to add to anaconda uploads (see `anaconda_upload`)
+
+    channel : str
+        Channel the packages are uploaded to, used for the checksum check. If
+        None, no check is done.
+
+    quay_target : str
+        quay.io target for images (see `mulled_upload`)
+
+    max_workers : int
+        Maximum number of concurrent uploads
+
+    max_tries : int
+        Maximum number of attempts per upload
+    """
+    def __init__(self, label=None, channel=None, quay_target=None,
+                 max_workers=MAX_WORKERS, max_tries=MAX_TRIES):
+        self.label = label
+        self.channel = channel
+        self.quay_target = quay_target
+        self.max_tries = max_tries
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.executor.shutdown(wait=True)
+
+    def _retry(self, func, *args):
+        return backoff.on_exception(
+            backoff.expo, sp.CalledProcessError, max_tries=self.max_tries,
+            on_backoff=lambda details: logger.warning(
+                'UPLOAD RETRY: %s (attempt %s failed)', args[0], details['tries'])
+        )(func)(*args)
+
+    def _upload_package(self, package):
+        if self.channel is not None and os.path.exists(package):
+            md5 = remote_md5(package, self.channel)
+            if md5 is not None and md5 == local_md5(package):
+                logger.info('UPLOAD SKIP: %s already in %s', package, self.channel)
+                return True
+        return self._retry(anaconda_upload, package, None, self.label)
+
+    def _upload_image(self, image):
+        self._retry(mulled_upload, image, self.quay_target)
+        return True
+
+    def upload_package(self, package):
+        """Queue upload of the package file **package** to anaconda.org"""
+        self.futures.append(
+            (package, self.executor.submit(self._upload_package, package)))
+
+    def upload_image(self, image):
+        """Queue upload of the mulled image **image** to quay.io"""
+        self.futures.append(
+            (image, self.executor.submit(self._upload_image, image)))
+
+    def wait(self):
+        """
+        Waits for all queued uploads and returns the list of packages and
+        images that failed to upload.
+        """
+        failed = []
+        for name, future in self.futures:
+            try:
+                success = future.result()
+            except (sp.CalledProcessError, ValueError) as e:
+                logger.error('UPLOAD FAILED: %s: %s', name, e)
+                success = False
+            except Exception:  # pylint: disable=broad-except
+                logger.exception('UPLOAD FAILED: %s', name)
+                success = False
+            if not success:
+                failed.append(name)
+        self.futures = []
+        return failed
@@ -7,8 +7,11 @@ import fnmatch
 import subprocess as sp
 import sys
 import shutil
+import tarfile
+import zipfile
 import contextlib
-from collections import Counter, Iterable, defaultdict, namedtuple
+import gzip
+from collections import Counter, Iterable, defaultdict, deque, namedtuple
 from itertools import product, chain, groupby
 import logging
 import datetime
@@ -35,6 +38,11 @@ import asyncio
 import aiohttp
 import backoff
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 
 class TqdmHandler(logging.StreamHandler):
     """Tqdm aware logging StreamHandler
@@ -210,7 +218,7 @@ def sandboxed_env(env):
         os.environ.update(orig)
 
 
-def load_all_meta(recipe, config=None, finalize=True):
+def load_all_meta(recipe, config=None, finalize=True, variants=None):
     """
     For each environment, yield the rendered meta.yaml.
 
@@ -221,6 +229,10 @@ def load_all_meta(recipe, config=None, finalize=True):
         of build/host dependencies. It involves costly dependency resolution
         via conda and also download of those packages (to inspect possible
         run_exports). For fast-running tasks like linting, set to False.
+
+    variants : dict or None
+        Variant values overriding those from the conda build config files
+        (e.g. ``{'python': ['3.6']}`` to render only for Python 3.6).
     """
     if config is None:
         config = load_conda_build_config()
@@ -233,6 +245,7 @@ def load_all_meta(recipe, config=None, finalize=True):
                                                 config=config,
                                                 finalize=finalize,
                                                 bypass_env_check=bypass_env_check,
+                                                variants=variants,
                                                 )]
 
 
@@ -337,7 +350,58 @@ def temp_os(platform):
         sys.platform = original
 
 
-def run(cmds, env=None, mask=None, **kwargs):
+#: Number of trailing output lines kept in memory by `run` in streaming mode
+RUN_TAIL_LINES = 1000
+
+
+def _mask_output(arg, mask):
+    """Hide secrets listed in **mask** within **arg** (see `run`)"""
+    if mask is None:
+        # caller has not considered masking, hide the entire command
+        # for security reasons
+        return '<hidden>'
+    elif mask is False:
+        # masking has been deactivated
+        return arg
+    for m in mask:
+        arg = arg.replace(m, '<hidden>')
+    return arg
+
+
+def _run_streaming(cmds, env, mask, logfile, tail, **kwargs):
+    """
+    Runs **cmds** reading the merged stdout/stderr line by line.
+
+    Masked lines are written to the gzip compressed **logfile** (if not None)
+    as they arrive; only the last **tail** lines are kept in memory. If
+    **mask** is None, the log only holds a single ``<hidden>`` line.
+    """
+    lines = deque(maxlen=tail)
+    with contextlib.ExitStack() as stack:
+        log = None
+        if logfile is not None:
+            log = stack.enter_context(
+                gzip.open(logfile, 'wt', encoding='utf-8'))
+            if mask is None:
+                # output is hidden entirely, don't log it line by line
+                log.write('<hidden>\n')
+                log = None
+        proc = stack.enter_context(
+            sp.Popen(cmds, stdout=sp.PIPE, stderr=sp.STDOUT, env=env, **kwargs))
+        for line in proc.stdout:
+            line = line.decode(errors='replace')
+            lines.append(line)
+            if log is not None:
+                log.write(_mask_output(line, mask))
+        returncode = proc.wait()
+    stdout = ''.join(lines)
+    if returncode:
+        raise sp.CalledProcessError(returncode, cmds, output=stdout)
+    return sp.CompletedProcess(cmds, returncode, stdout=stdout)
+
+
+def run(cmds, env=None, mask=None, stream=False, logfile=None,
+        tail=RUN_TAIL_LINES, **kwargs):
     """
     Wrapper around subprocess.run()
 
@@ -348,30 +412,34 @@ def run(cmds, env=None, mask=None, **kwargs):
     Also uses check=True and merges stderr with stdout. If a CalledProcessError
     is raised, the output is decoded.
 
+    If `stream` is True, output is consumed line by line while the process
+    runs instead of being buffered in full. Only the last `tail` lines are
+    kept (and returned as stdout, also on error), so memory use stays
+    constant for very chatty commands. If `logfile` is given, the complete
+    output is written to it gzip compressed, masked the same way as the
+    output logged on error.
+
     Returns the subprocess.CompletedProcess object.
     """
     try:
-        p = sp.run(cmds, stdout=sp.PIPE, stderr=sp.STDOUT, check=True, env=env,
-                   **kwargs)
-        p.stdout = p.stdout.decode(errors='replace')
+        if stream:
+            p = _run_streaming(cmds, env, mask, logfile, tail, **kwargs)
+        else:
+            p = sp.run(cmds, stdout=sp.PIPE, stderr=sp.STDOUT, check=True, env=env,
+                       **kwargs)
+            p.stdout = p.stdout.decode(errors='replace')
     except sp.CalledProcessError as e:
-        e.stdout = e.stdout.decode(errors='replace')
+        if isinstance(e.stdout, bytes):
+            e.stdout = e.stdout.decode(errors='replace')
         # mask command arguments
-
-        def do_mask(arg):
-            if mask is None:
-                # caller has not considered masking, hide the entire command
-                # for security reasons
-                return '<hidden>'
-            elif mask is False:
-                # masking has been deactivated
-                return arg
-            for m in mask:
-                arg = arg.replace(m, '<hidden>')
-            return arg
-        e.cmd = [do_mask(c) for c in e.cmd]
+        e.cmd = [_mask_output(c, mask) for c in e.cmd]
         logger.error('COMMAND FAILED: %s', ' '.join(e.cmd))
-        logger.error('STDOUT+STDERR:\n%s', do_mask(e.stdout))
+        if stream:
+            logger.error('STDOUT+STDERR (last %s lines%s):\n%s', tail,
+                         ', full log in ' + logfile if logfile else '',
+                         _mask_output(e.stdout, mask))
+        else:
+            logger.error('STDOUT+STDERR:\n%s', _mask_output(e.stdout, mask))
         raise e
     return p
 
@@ -851,6 +919,14 @@ def _filter_existing_packages(metas, check_channels):
 
 
 def get_package_paths(recipe, check_channels, force=False):
+    """
+    Returns the paths of packages to be built for **recipe**.
+
+    The paths are those reported by conda-build. With the pinned
+    conda-build 3.15.1 these always end in ``.tar.bz2``; the version does
+    not know the ``pkg_format`` setting and cannot build ``.conda``
+    packages.
+    """
     if not force:
         if check_recipe_skippable(recipe, check_channels):
             # NB: If we skip early here, we don't detect possible divergent builds.
@@ -894,6 +970,71 @@ def get_package_paths(recipe, check_channels, force=False):
         api.get_output_file_paths(meta) for meta in build_metas))
 
 
+#: File extensions of conda packages (``.conda`` is the zstd based v2 format)
+PACKAGE_EXTENSIONS = ('.tar.bz2', '.conda')
+
+
+def package_dist_name(path):
+    """
+    Returns the ``name-version-build`` part of the package file name **path**
+    """
+    fn = os.path.basename(path)
+    for ext in PACKAGE_EXTENSIONS:
+        if fn.endswith(ext):
+            return fn[:-len(ext)]
+    raise ValueError('Unrecognized package file {}'.format(path))
+
+
+def _open_info_tar(path, stack):
+    """Open the tar stream holding the ``info/`` files of package **path**"""
+    if path.endswith('.conda'):
+        # .conda packages are zip files containing the metadata and the
+        # payload as separate zstd compressed tarballs
+        if zstandard is None:
+            raise RuntimeError(
+                'reading {} requires the zstandard module'.format(path))
+        pkg_zip = stack.enter_context(zipfile.ZipFile(path))
+        info_name = next(name for name in pkg_zip.namelist()
+                         if name.startswith('info-') and name.endswith('.tar.zst'))
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            stack.enter_context(pkg_zip.open(info_name)))
+        return stack.enter_context(tarfile.open(fileobj=reader, mode='r|'))
+    return stack.enter_context(tarfile.open(path, 'r|bz2'))
+
+
+def iter_package_info(path, names=None):
+    """
+    Yield ``(name, content)`` for files in the ``info/`` folder of the
+    package at **path** (``.tar.bz2`` or ``.conda``).
+
+    The package is read as a stream; nothing is extracted to disk. If
+    **names** is given, only those members are returned and reading stops as
+    soon as all of them have been found. Otherwise, reading stops at the end
+    of the ``info/`` block. As conda-build writes the ``info/`` files first,
+    the payload of ``.tar.bz2`` packages is not decompressed. The payload of
+    ``.conda`` packages is never read.
+    """
+    wanted = set(names) if names is not None else None
+    in_info = False
+    with contextlib.ExitStack() as stack:
+        tar = _open_info_tar(path, stack)
+        for member in tar:
+            if not member.name.startswith('info/'):
+                if in_info:
+                    break
+                continue
+            in_info = True
+            if not member.isfile():
+                continue
+            if wanted is not None:
+                if member.name not in wanted:
+                    continue
+                wanted.discard(member.name)
+            yield member.name, tar.extractfile(member).read()
+            if wanted is not None and not wanted:
+                break
+
+
 def get_blacklist(blacklists, recipe_folder):
     "Return list of recipes to skip from blacklists"
     blacklist = set()
@@ -1227,13 +1368,14 @@ class RepoData:
         if RepoData.__instance is None:
             assert RepoData.config is not None, ("bug: ensure to load config "
                                                  "before instantiating RepoData.")
-            RepoData.__instance = object.__new__(cls)
+            instance = object.__new__(cls)
+            # Initialized here rather than in __init__, which Python calls
+            # again each time the singleton is requested.
+            instance.cache_file = None
+            instance._df = None
+            RepoData.__instance = instance
         return RepoData.__instance
 
-    def __init__(self):
-        self.cache_file = None
-        self._df = None
-
     def set_cache(self, cache):
         if self._df is not None:
             warnings.warn("RepoData cache set after first use", BiocondaUtilsWarning)
@@ -1274,7 +1416,11 @@ class RepoData:
         def to_dataframe(json_data, meta_data):
             channel, platform = meta_data
             repo = json.loads(json_data)
-            df = pd.DataFrame.from_dict(repo['packages'], 'index',
+            packages = repo['packages']
+            for fn, pkg in repo.get('packages.conda', {}).items():
+                # builds may be available in both formats, count them once
+                packages.setdefault(package_dist_name(fn) + '.tar.bz2', pkg)
+            df = pd.DataFrame.from_dict(packages, 'index',
                                         columns=self._load_columns)
             # Ensure that version is always a string.
             df['version'] = df['version'].astype(str)
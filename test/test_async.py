@@ -0,0 +1,507 @@
+import asyncio
+import itertools
+import os
+import threading
+import time
+from email.utils import formatdate
+
+import aioftp
+import pytest
+
+from bioconda_utils.async import (
+    AsyncFilter, AsyncPipeline, AsyncRequests, CacheStore, CircuitBreaker, EndProcessing,
+    EndProcessingItem, HostLimiter, HostUnavailable, HttpCacheEntry, KnownFailure,
+    freshness_lifetime, is_storable, parse_retry_after,
+    HEURISTIC_FRESHNESS_MAX
+)
+
+
+NOW = 1500000000.0
+
+
+def http_date(timestamp):
+    return formatdate(timestamp, usegmt=True)
+
+
+@pytest.mark.parametrize('headers,lifetime', [
+    ({}, 0),
+    ({'Cache-Control': 'max-age=300'}, 300),
+    ({'Cache-Control': 'public, max-age="300"', 'Age': '100'}, 200),
+    ({'Cache-Control': 'max-age=300', 'Expires': http_date(NOW + 600)}, 300),
+    ({'Cache-Control': 'no-cache, max-age=300'}, 0),
+    ({'Cache-Control': 'max-age=60', 'Age': '120'}, 0),
+    ({'Expires': http_date(NOW + 600), 'Date': http_date(NOW)}, 600),
+    ({'Expires': '0'}, 0),
+    ({'Last-Modified': http_date(NOW - 1000), 'Date': http_date(NOW)}, 100),
+    ({'Last-Modified': http_date(NOW - 10**9)}, HEURISTIC_FRESHNESS_MAX),
+])
+def test_freshness_lifetime(headers, lifetime):
+    assert freshness_lifetime(headers, NOW) == lifetime
+
+
+def test_is_storable():
+    assert is_storable({})
+    assert is_storable({'Cache-Control': 'no-cache'})
+    assert not is_storable({'Cache-Control': 'private, no-store'})
+
+
+def test_http_cache_entry():
+    entry = HttpCacheEntry("text", {'ETag': '"abc"', 'Cache-Control': 'max-age=10'}, NOW)
+    assert entry.is_fresh(NOW + 5)
+    assert not entry.is_fresh(NOW + 10)
+    assert entry.conditional_headers() == {'If-None-Match': '"abc"'}
+
+    # a 304 without validators keeps the old ones
+    entry.update({'Cache-Control': 'max-age=100'}, NOW + 20)
+    assert entry.is_fresh(NOW + 100)
+    assert entry.etag == '"abc"'
+
+    entry = HttpCacheEntry("text", {'Last-Modified': http_date(NOW)}, NOW)
+    assert not entry.is_fresh(NOW)
+    assert entry.conditional_headers() == {'If-Modified-Since': http_date(NOW)}
+
+
+def test_cache_store(tmpdir):
+    fname = str(tmpdir.join('sub', 'cache.sqlite'))
+    with CacheStore(fname) as store:
+        store.set('url_text', 'http://a', 'text')
+        store.set('url_checksum', 'http://a', 'abc')
+        store.set('ftp_list', 'ftp://a', [])
+        store.set('url_text', 'http://b', 'gone', ttl=-1)
+        assert store.get('url_checksum', 'http://a') == 'abc'
+        assert store.get('url_text', 'http://b') is None
+        store.delete('url_checksum', 'http://a')
+
+    # entries are persisted
+    with CacheStore(fname) as store:
+        assert store.get('url_text', 'http://a') == 'text'
+        assert store.get('url_checksum', 'http://a') is None
+        assert store.get('ftp_list', 'ftp://a') == []
+
+
+def test_cache_store_evicts_least_recently_used(tmpdir, monkeypatch):
+    clock = itertools.count(NOW)
+    monkeypatch.setattr(time, 'time', lambda: next(clock))
+    with CacheStore(str(tmpdir.join('cache.sqlite')), max_size=1000) as store:
+        for num in range(3):
+            store.set('http', str(num), 'x' * 400)
+        store.get('http', '0')
+        assert store.evict() == 1
+        assert store.get('http', '1') is None
+        assert store.get('http', '0') is not None
+        assert store.get('http', '2') is not None
+
+
+def test_cache_store_replaces_unreadable_file(tmpdir):
+    fname = str(tmpdir.join('cache.sqlite'))
+    with open(fname, 'wb') as out:
+        out.write(b'not a database' * 100)
+    with CacheStore(fname) as store:
+        assert store.get('url_text', 'http://a') is None
+        store.set('url_text', 'http://a', 'text')
+    assert os.path.exists(fname)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None, NOW) == 0
+    assert parse_retry_after('120', NOW) == 120
+    assert parse_retry_after(http_date(NOW + 60), NOW) == 60
+    assert parse_retry_after(http_date(NOW - 60), NOW) == 0
+    assert parse_retry_after('soon', NOW) == 0
+
+
+def test_host_limiter_aimd():
+    limiter = HostLimiter(max_concurrency=8)
+    limiter.feedback(429, {'Retry-After': '30'})
+    assert limiter.concurrency == 4
+    assert limiter.blocked_until > time.monotonic() + 25
+    # only one decrease per interval
+    limiter.feedback(503, {})
+    assert limiter.concurrency == 4
+    for _ in range(10):
+        limiter.feedback(200, {})
+    assert 5 < limiter.concurrency <= 8
+
+
+def test_host_limiter_concurrency():
+    loop = asyncio.get_event_loop()
+    limiter = HostLimiter(max_concurrency=2)
+    loop.run_until_complete(limiter.acquire())
+    loop.run_until_complete(limiter.acquire())
+    waiting = asyncio.ensure_future(limiter.acquire())
+    loop.run_until_complete(asyncio.sleep(0.01))
+    assert not waiting.done()
+    limiter.release()
+    loop.run_until_complete(asyncio.wait_for(waiting, 1))
+    assert limiter.active == 2
+
+
+def test_host_limiter_rate(monkeypatch):
+    clock = [NOW]
+    monkeypatch.setattr(time, 'monotonic', lambda: clock[0])
+    limiter = HostLimiter(rate=2, burst=2)
+    assert limiter._wait_time(NOW) == 0
+    limiter._tokens = 0
+    assert limiter._wait_time(NOW) == 0.5
+    assert limiter._wait_time(NOW + 0.5) == 0
+
+
+def test_circuit_breaker(monkeypatch):
+    clock = [NOW]
+    monkeypatch.setattr(time, 'monotonic', lambda: clock[0])
+    breaker = CircuitBreaker('example.org', threshold=2, reset_timeout=10)
+    breaker.failure()
+    breaker.check()
+    breaker.failure()
+    with pytest.raises(HostUnavailable):
+        breaker.check()
+
+    # after the timeout, requests are let through again
+    clock[0] += 10
+    breaker.check()
+    # failing again doubles the timeout
+    breaker.failure()
+    clock[0] += 10
+    with pytest.raises(HostUnavailable):
+        breaker.check()
+    clock[0] += 10
+    breaker.check()
+    breaker.success()
+    assert breaker.opened_at is None
+    assert breaker.timeout == 10
+
+
+def test_host_limiter_circuit_breaker():
+    loop = asyncio.get_event_loop()
+    limiter = HostLimiter(breaker=CircuitBreaker('example.org', threshold=2))
+    limiter.feedback(404, {})
+    limiter.feedback(503, {})
+    limiter.feedback(429, {})
+    limiter.feedback(502, {})
+    with pytest.raises(HostUnavailable):
+        loop.run_until_complete(limiter.acquire())
+    assert limiter.active == 0
+
+
+def test_single_flight():
+    loop = asyncio.get_event_loop()
+    req = AsyncRequests()
+    calls = []
+
+    async def fetch(url):
+        calls.append(url)
+        await asyncio.sleep(0.01)
+        if url == 'bad':
+            raise ValueError(url)
+        return url.upper()
+
+    async def run(urls):
+        return await asyncio.gather(
+            *(req.single_flight('text', url, fetch, url) for url in urls),
+            return_exceptions=True)
+
+    res = loop.run_until_complete(run(['a', 'a', 'b', 'a', 'bad', 'bad']))
+    assert res[:4] == ['A', 'A', 'B', 'A']
+    assert all(isinstance(exc, ValueError) for exc in res[4:])
+    assert sorted(calls) == ['a', 'b', 'bad']
+    assert not req.inflight
+
+    # cancelling one caller does not cancel the shared request
+    first = asyncio.ensure_future(req.single_flight('text', 'c', fetch, 'c'))
+    second = asyncio.ensure_future(req.single_flight('text', 'c', fetch, 'c'))
+    loop.run_until_complete(asyncio.sleep(0))
+    first.cancel()
+    assert loop.run_until_complete(second) == 'C'
+    assert calls.count('c') == 1
+
+
+def test_exit_cancels_inflight(tmpdir):
+    loop = asyncio.get_event_loop()
+    finished = []
+
+    async def fetch(req, url):
+        await asyncio.sleep(10)
+        req.cache.set('url_text', url, 'text')
+        finished.append(url)
+
+    async def run():
+        async with AsyncRequests(cache_fn=str(tmpdir.join('cache.sqlite'))) as req:
+            caller = asyncio.ensure_future(req.single_flight('text', 'a', fetch, req, 'a'))
+            await asyncio.sleep(0)
+            caller.cancel()
+        return req
+
+    req = loop.run_until_complete(run())
+    assert not req.inflight
+    assert not finished
+
+
+class Response:
+    def __init__(self, status):
+        self.status = status
+        self.headers = {}
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise ValueError(self.status)
+
+
+@pytest.mark.parametrize('http_cache', [False, True])
+def test_negative_cache(tmpdir, monkeypatch, http_cache):
+    clock = [NOW]
+    monkeypatch.setattr(time, 'time', lambda: clock[0])
+    req = AsyncRequests(http_cache_fn=str(tmpdir.join('http.sqlite')) if http_cache else None)
+    if req.http_cache:
+        req.http_cache.open()
+    limiter = HostLimiter()
+    with pytest.raises(ValueError):
+        req._check_response('http://a', limiter, Response(404))
+    with pytest.raises(KnownFailure):
+        req.check_url('http://a')
+
+    # e.g. the tarball of a new version may be published later
+    with pytest.raises(ValueError):
+        req._check_response('http://b', limiter, Response(404), negative_cache=False)
+    req.check_url('http://b')
+
+    clock[0] += AsyncRequests.NEGATIVE_CACHE_TTL
+    req.check_url('http://a')
+
+
+class TextResponse(Response):
+    def __init__(self, text):
+        super().__init__(200)
+        self._text = text
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def text(self):
+        return self._text
+
+
+class FakeSession:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def get(self, url, headers=None):
+        self.calls.append(url)
+        return TextResponse('x' * 400)
+
+
+class FakeFtp:
+    def __init__(self, calls):
+        self.calls = calls
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def list(self, path):
+        self.calls.append(path)
+        return [(path + '/file', {})]
+
+
+def make_cached_requests(tmpdir, monkeypatch, calls):
+    req = AsyncRequests(cache_fn=str(tmpdir.join('cache.sqlite')))
+    req.cache.open()
+    req.session = FakeSession(calls)
+
+    async def get_checksum_from_http(url, desc):
+        calls.append(url)
+        return 'abc'
+
+    monkeypatch.setattr(req, 'get_checksum_from_http', get_checksum_from_http)
+    monkeypatch.setattr(aioftp, 'ClientSession', lambda *args, **kwargs: FakeFtp(calls))
+    return req
+
+
+@pytest.mark.parametrize('namespace', ['url_text', 'url_checksum', 'ftp_list'])
+def test_cache_expires(tmpdir, monkeypatch, namespace):
+    clock = [NOW]
+    monkeypatch.setattr(time, 'time', lambda: clock[0])
+    calls = []
+    req = make_cached_requests(tmpdir, monkeypatch, calls)
+    fetch = {
+        'url_text': lambda: req._get_text_from_url('http://a'),
+        'url_checksum': lambda: req._get_checksum_from_url('http://a', 'a'),
+        'ftp_list': lambda: req._get_ftp_listing('ftp://a/b'),
+    }[namespace]
+    loop = asyncio.get_event_loop()
+    first = loop.run_until_complete(fetch())
+    assert loop.run_until_complete(fetch()) == first
+    assert len(calls) == 1
+
+    clock[0] += AsyncRequests.CACHE_TTL[namespace]
+    loop.run_until_complete(fetch())
+    assert len(calls) == 2
+    req.cache.close()
+
+
+def test_cache_evicts(tmpdir, monkeypatch):
+    clock = itertools.count(NOW)
+    monkeypatch.setattr(time, 'time', lambda: next(clock))
+    monkeypatch.setattr(AsyncRequests, 'CACHE_MAX_SIZE', 1000)
+    calls = []
+    req = make_cached_requests(tmpdir, monkeypatch, calls)
+    loop = asyncio.get_event_loop()
+    for url in ('http://a', 'http://b', 'http://c'):
+        loop.run_until_complete(req._get_text_from_url(url))
+    assert req.cache.evict() == 1
+    assert req.cache.get('url_text', 'http://a') is None
+    assert req.cache.get('url_text', 'http://c') is not None
+    req.cache.close()
+
+
+class CountingPipeline(AsyncPipeline):
+    def __init__(self, num_items, **kwargs):
+        super().__init__(**kwargs)
+        self.num_items = num_items
+        self.loaded = 0
+
+    def get_item_iterator(self):
+        for num in range(self.num_items):
+            self.loaded += 1
+            yield num
+
+    async def process(self, item):
+        try:
+            return await super().process(item)
+        except EndProcessingItem:
+            return True
+
+
+class Collect(AsyncFilter):
+    def __init__(self, pipeline, stop_at=None):
+        super().__init__(pipeline)
+        self.stop_at = stop_at
+        self.items = []
+
+    async def apply(self, item):
+        await asyncio.sleep(0)
+        if item == self.stop_at:
+            raise EndProcessing()
+        if item % 7 == 0:
+            raise ValueError(item)
+        self.items.append(item)
+        return item
+
+
+def test_pipeline_processes_all_items():
+    pipeline = CountingPipeline(100, max_inflight=5)
+    pipeline.add(Collect)
+    assert pipeline.run() is False  # multiples of 7 failed
+    assert sorted(pipeline.filters[0].items) == [num for num in range(100) if num % 7]
+
+
+def test_pipeline_end_processing_is_cheap():
+    pipeline = CountingPipeline(10000, max_inflight=5)
+    pipeline.add(Collect, stop_at=20)
+    pipeline.run()
+    assert len(pipeline.filters[0].items) < 100
+    # items are loaded lazily and loading stopped
+    assert pipeline.loaded < 100
+
+
+class Slow(AsyncFilter):
+    def __init__(self, pipeline):
+        super().__init__(pipeline)
+        self.running = 0
+        self.max_running = 0
+
+    async def apply(self, item):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.001)
+        self.running -= 1
+        if item % 10 == 0:
+            raise EndProcessingItem(item)
+        return item
+
+
+def test_pipeline_stage_limits_and_metrics():
+    pipeline = CountingPipeline(50, max_inflight=20)
+    pipeline.add(Slow)
+    pipeline.add(Collect)
+    pipeline.set_max_concurrency('Slow', 3)
+    with pytest.raises(ValueError):
+        pipeline.set_max_concurrency('Missing', 3)
+    # a stage without workers would never process its items
+    with pytest.raises(ValueError):
+        pipeline.set_max_concurrency('Slow', -1)
+    pipeline.run()
+    assert pipeline.filters[0].max_running == 3
+
+    slow, collect = pipeline.get_metrics()
+    assert slow['stage'] == 'Slow'
+    assert slow['processed'] == 50
+    assert slow['dropped'] == 5
+    assert slow['passed'] == 45
+    assert slow['max_waiting'] > 0
+    assert sum(slow['latency_histogram'].values()) == 50
+    assert collect['processed'] == 45
+    assert collect['failed'] == 7  # multiples of 7 except 0
+    assert pipeline.filters[0].metrics.active == 0
+    assert pipeline.filters[0].metrics.waiting == 0
+    assert 'Slow: 50 items' in str(pipeline.filters[0].metrics)
+
+
+class Skip(AsyncFilter):
+    """Drops all but every 10th item, signals once all items were seen"""
+    def __init__(self, pipeline):
+        super().__init__(pipeline)
+        self.seen = 0
+        self.all_seen = asyncio.Event()
+
+    async def apply(self, item):
+        self.seen += 1
+        if self.seen == self.pipeline.num_items:
+            self.all_seen.set()
+        if item % 10:
+            raise EndProcessingItem(item)
+        return item
+
+
+class Gate(AsyncFilter):
+    """Blocks until all items passed through `Skip`"""
+    max_concurrency = 1
+
+    async def apply(self, item):
+        await asyncio.wait_for(self.pipeline.filters[0].all_seen.wait(), 5)
+        return item
+
+
+def test_pipeline_saturated_stage_does_not_block_others():
+    pipeline = CountingPipeline(30, max_inflight=2)
+    pipeline.add(Skip)
+    pipeline.add(Gate)
+    assert pipeline.run() is True
+    skip, gate = pipeline.get_metrics()
+    assert skip['dropped'] == 27
+    assert gate['passed'] == 3
+    assert gate['max_waiting'] == 2
+
+
+def test_pipeline_stage_limit_above_max_inflight():
+    pipeline = CountingPipeline(50, max_inflight=2)
+    pipeline.add(Slow)
+    pipeline.set_max_concurrency('Slow', 10)
+    pipeline.run()
+    assert pipeline.filters[0].max_running == 10
+    assert pipeline.filters[0].metrics.processed == 50
+
+
+def test_pipeline_run_io_is_concurrent():
+    pipeline = CountingPipeline(0, io_workers=4, proc_workers=1)
+    # would raise BrokenBarrierError if the calls were serialized
+    barrier = threading.Barrier(4, timeout=5)
+
+    async def run():
+        return await asyncio.gather(*(pipeline.run_io(barrier.wait) for _ in range(4)))
+
+    assert sorted(pipeline.loop.run_until_complete(run())) == [0, 1, 2, 3]
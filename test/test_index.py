@@ -0,0 +1,106 @@
+import io
+import json
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from bioconda_utils import index
+
+
+def _info_tar(fileobj, mode, name, version, build):
+    data = json.dumps({'name': name, 'version': version, 'build': build,
+                       'build_number': 0, 'depends': []}).encode()
+    with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+        info = tarfile.TarInfo('info/index.json')
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+
+def _make_pkg(subdir, name, version='0.1', build='0'):
+    fn = '{}-{}-{}.tar.bz2'.format(name, version, build)
+    with open(os.path.join(subdir, fn), 'wb') as fout:
+        _info_tar(fout, 'w:bz2', name, version, build)
+    return fn
+
+
+def _make_conda_pkg(subdir, name, version='0.1', build='0'):
+    zstandard = pytest.importorskip('zstandard')
+    dist = '{}-{}-{}'.format(name, version, build)
+    buf = io.BytesIO()
+    _info_tar(buf, 'w', name, version, build)
+    with zipfile.ZipFile(os.path.join(subdir, dist + '.conda'), 'w') as pkg_zip:
+        pkg_zip.writestr('info-{}.tar.zst'.format(dist),
+                         zstandard.ZstdCompressor().compress(buf.getvalue()))
+    return dist + '.conda'
+
+
+def _load_repodata(subdir):
+    with open(os.path.join(subdir, 'repodata.json')) as fin:
+        return json.load(fin)
+
+
+def test_update_index_incremental(tmpdir):
+    subdir = str(tmpdir.join('linux-64'))
+    os.makedirs(subdir)
+    one = _make_pkg(subdir, 'one')
+    assert index.update_index(subdir) == 1
+    repodata = _load_repodata(subdir)
+    assert repodata['info']['subdir'] == 'linux-64'
+    assert repodata['packages'][one]['name'] == 'one'
+    assert 'sha256' in repodata['packages'][one]
+
+    # nothing changed, nothing read
+    assert index.update_index(subdir) == 0
+
+    # only the new package is read
+    two = _make_pkg(subdir, 'two')
+    assert index.update_index(subdir) == 1
+    assert set(_load_repodata(subdir)['packages']) == {one, two}
+
+    # removed packages are dropped
+    os.unlink(os.path.join(subdir, one))
+    assert index.update_index(subdir) == 0
+    assert set(_load_repodata(subdir)['packages']) == {two}
+
+
+def test_update_index_creates_empty_subdir(tmpdir):
+    subdir = str(tmpdir.join('noarch'))
+    assert index.update_index(subdir) == 0
+    assert _load_repodata(subdir)['packages'] == {}
+
+
+def test_update_index_conda_format(tmpdir):
+    subdir = str(tmpdir.join('noarch'))
+    os.makedirs(subdir)
+    one = _make_pkg(subdir, 'one')
+    two = _make_conda_pkg(subdir, 'two')
+    assert index.update_index(subdir) == 2
+    repodata = _load_repodata(subdir)
+    assert set(repodata['packages']) == {one}
+    assert set(repodata['packages.conda']) == {two}
+
+
+def test_update_index_replaces_stale_current_repodata(tmpdir):
+    subdir = str(tmpdir.join('linux-64'))
+    os.makedirs(subdir)
+    one = _make_pkg(subdir, 'one')
+    index.update_index(subdir)
+    # e.g. left over from an earlier `conda index`
+    with open(os.path.join(subdir, 'current_repodata.json'), 'w') as fout:
+        json.dump({'packages': {}}, fout)
+    assert index.update_index(subdir) == 0
+    two = _make_pkg(subdir, 'two')
+    index.update_index(subdir)
+    with open(os.path.join(subdir, 'current_repodata.json')) as fin:
+        assert set(json.load(fin)['packages']) == {one, two}
+
+
+def test_update_channel_index(tmpdir):
+    subdir = str(tmpdir.join('linux-64'))
+    os.makedirs(subdir)
+    one = _make_pkg(subdir, 'one')
+    index.update_channel_index([os.path.join(subdir, one)])
+    assert set(_load_repodata(subdir)['packages']) == {one}
+    assert _load_repodata(str(tmpdir.join('noarch')))['packages'] == {}
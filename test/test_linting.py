@@ -1,3 +1,9 @@
+import io
+import json
+import os
+
+import pandas
+
 from helpers import Recipes
 from bioconda_utils import lint_functions
 from bioconda_utils import linting, utils
@@ -1047,3 +1053,315 @@ def test_should_not_use_fn():
 #            ''',
 #        ]
 #    )
+
+
+def test_lint_jobs():
+    r = Recipes(
+        '''
+        one:
+          meta.yaml: |
+            package:
+              name: one
+              version: "0.1"
+        two:
+          meta.yaml: |
+            package:
+              name: two
+              version: "0.1"
+            about:
+              home: "http://bioconda.github.io"
+        three:
+          meta.yaml: |
+            package:
+              name: three
+              version: "0.1"
+        ''', from_string=True)
+    r.write_recipes()
+    lint_args = linting.LintArgs(registry=[lint_functions.missing_home,
+                                           lint_functions.missing_license])
+    serial = linting.lint(r.recipe_dirs.values(), lint_args)
+    parallel = linting.lint(r.recipe_dirs.values(), lint_args, jobs=2)
+    assert list(serial['recipe']) == sorted(serial['recipe'])
+    assert serial[['recipe', 'check']].equals(parallel[['recipe', 'check']])
+
+
+def test_lint_cache(tmpdir):
+    r = Recipes(
+        '''
+        one:
+          meta.yaml: |
+            package:
+              name: one
+              version: "0.1"
+        two:
+          meta.yaml: |
+            package:
+              name: two
+              version: "0.1"
+            about:
+              home: "http://bioconda.github.io"
+        ''', from_string=True)
+    r.write_recipes()
+    cache = str(tmpdir.join('lint-cache.pkl'))
+    lint_args = linting.LintArgs(registry=[lint_functions.missing_home])
+    first = linting.lint(r.recipe_dirs.values(), lint_args, cache=cache)
+    assert list(first['recipe']) == [r.recipe_dirs['one']]
+
+    cached = linting.LintCache(cache, lint_args.registry)
+    assert cached.get(r.recipe_dirs['one'], ()) is not None
+
+    # editing a recipe invalidates its entry only
+    with open(os.path.join(r.recipe_dirs['two'], 'meta.yaml'), 'w') as fout:
+        fout.write('package:\n  name: two\n  version: "0.2"\n')
+    cached = linting.LintCache(cache, lint_args.registry)
+    assert cached.get(r.recipe_dirs['two'], ()) is None
+    assert cached.get(r.recipe_dirs['one'], ()) is not None
+    # as do changed skip directives
+    assert cached.get(r.recipe_dirs['one'], ('missing_home',)) is None
+
+    second = linting.lint(r.recipe_dirs.values(), lint_args, cache=cache)
+    assert sorted(second['recipe']) == sorted(r.recipe_dirs.values())
+
+
+def test_lint_cache_rechecks_repodata(tmpdir, monkeypatch):
+    class RepoData:
+        df = pandas.DataFrame(columns=['name', 'version', 'build_number', 'channel'])
+    monkeypatch.setattr(utils, 'RepoData', RepoData)
+    r = Recipes(
+        '''
+        one:
+          meta.yaml: |
+            package:
+              name: one
+              version: "0.1"
+        ''', from_string=True)
+    r.write_recipes()
+    cache = str(tmpdir.join('lint-cache.pkl'))
+    lint_args = linting.LintArgs(registry=[lint_functions.missing_home,
+                                           lint_functions.in_other_channels])
+    first = linting.lint(r.recipe_dirs.values(), lint_args, cache=cache)
+    assert list(first['check']) == ['missing_home']
+
+    # updated channel data does not invalidate the cache, but is checked
+    RepoData.df = pandas.DataFrame({
+        'name': ['one'], 'version': ['0.1'], 'build_number': [0],
+        'channel': ['conda-forge']})
+    hits, packages = linting.LintCache(cache, lint_args.registry).get(
+        r.recipe_dirs['one'], ())
+    assert [hit['check'] for hit in hits] == ['missing_home']
+    assert packages[0].package_name == 'one'
+    second = linting.lint(r.recipe_dirs.values(), lint_args, cache=cache)
+    assert list(second['check']) == ['missing_home', 'in_other_channels']
+
+
+def test_lint_context(tmpdir):
+    tmpdir.join('meta.yaml').write('package:\n  name: one  # [linux]\n')
+    tmpdir.join('build.sh').write('python setup.py install\n')
+    tmpdir.join('bld.bat').write('')
+    context = lint_functions.LintContext(str(tmpdir))
+    assert os.path.join(context, 'meta.yaml') == str(tmpdir.join('meta.yaml'))
+    assert lint_functions.lint_context(context) is context
+    assert context.has_selectors
+    assert context.glob('*.bat') == ['bld.bat']
+    assert context.read('run_test.sh') is None
+    assert context.lines('build.sh') == ['python setup.py install']
+
+    # contents are read once
+    tmpdir.join('build.sh').write('')
+    assert context.read('build.sh') == 'python setup.py install\n'
+
+
+def test_lint_packages(monkeypatch):
+    class RepoData:
+        df = pandas.DataFrame({
+            'name': ['one', 'one', 'two'],
+            'version': ['0.1', '0.1', '0.2'],
+            'build_number': [0, 1, 0],
+            'channel': ['bioconda', 'conda-forge', 'bioconda'],
+        })
+    monkeypatch.setattr(utils, 'RepoData', RepoData)
+
+    recipe_packages = {
+        'recipes/one': [linting.PackageMeta('one', 'one', '0.1', 0, ())],
+        'recipes/two': [linting.PackageMeta('two', 'two', '0.2', '0', ())],
+        'recipes/three': [linting.PackageMeta('three', 'three', '0.2', 0,
+                                              ('in_other_channels',))],
+    }
+    results = linting.lint_packages(
+        recipe_packages,
+        [lint_functions.in_other_channels, lint_functions.already_in_bioconda,
+         lint_functions.missing_home],
+        {'recipes/two': ['already_in_bioconda']})
+    assert [hit['check'] for hit in results['recipes/one']] == [
+        'in_other_channels', 'already_in_bioconda']
+    assert results['recipes/one'][0]['info']['exists_in_channels'] == {'conda-forge'}
+    assert results['recipes/two'] == []
+    assert results['recipes/three'] == []
+
+
+def test_lint_fast(monkeypatch):
+    r = Recipes(
+        '''
+        one:
+          meta.yaml: |
+            {% set version = "0.1" %}
+            package:
+              name: one
+              version: {{ version }}
+            source:
+              url: https://example.com/one-{{ version }}.tar.gz
+        ''', from_string=True)
+    r.write_recipes()
+    recipe = r.recipe_dirs['one']
+
+    def load_all_meta(*args, **kwargs):
+        raise AssertionError('recipe should not be rendered')
+
+    monkeypatch.setattr(utils, 'load_all_meta', load_all_meta)
+    profile = linting.LintProfile()
+    hits, packages = linting.lint_recipe(
+        recipe, [lint_functions.missing_home, lint_functions.missing_hash],
+        fast=True, profile=profile)
+    assert [hit['check'] for hit in hits] == ['missing_home', 'missing_hash']
+    assert hits[0]['info']['output'] == 'one'
+    assert packages[0].get_value('package/version') == '0.1'
+    assert {row['category'] for row in profile.rows()} == {'parse', 'lint'}
+
+
+def test_lint_fast_skips_rendered_lints(monkeypatch):
+    r = Recipes(
+        '''
+        one:
+          meta.yaml: |
+            package:
+              name: one
+              version: "0.1"
+        ''', from_string=True)
+    r.write_recipes()
+
+    def load_all_meta(*args, **kwargs):
+        raise AssertionError('recipe should not be rendered')
+
+    monkeypatch.setattr(utils, 'load_all_meta', load_all_meta)
+    hits, _ = linting.lint_recipe(
+        r.recipe_dirs['one'],
+        [lint_functions.missing_home, lint_functions.missing_tests,
+         lint_functions.in_other_channels],
+        fast=True)
+    assert [hit['check'] for hit in hits] == ['missing_home']
+
+    class RepoData:
+        @property
+        def df(self):
+            raise AssertionError('channel data should not be loaded')
+
+    monkeypatch.setattr(utils, 'RepoData', RepoData)
+    lint_args = linting.LintArgs(registry=lint_functions.registry)
+    report = linting.lint(r.recipe_dirs.values(), lint_args, fast=True)
+    assert 'missing_tests' not in set(report['check'])
+    assert 'missing_home' in set(report['check'])
+
+
+def test_representative_variants():
+    spec = {
+        'python': ['2.7', '3.6', '3.7'],
+        'numpy': ['1.11', '1.11', '1.15'],
+        'perl': ['5.26.2'],
+        'r_base': ['3.4.1', '3.5.1'],
+        'zip_keys': [['python', 'numpy']],
+        'pin_run_as_build': {'htslib': {'max_pin': 'x.x'}},
+    }
+    assert linting.representative_variants(spec, set()) == {
+        'python': ['2.7'], 'numpy': ['1.11'], 'r_base': ['3.4.1']}
+    # zipped keys are kept together
+    assert linting.representative_variants(spec, {'numpy', 'linux'}) == {
+        'r_base': ['3.4.1']}
+
+
+def test_lint_context_variables(tmpdir):
+    tmpdir.join('meta.yaml').write(
+        'package:\n'
+        '  name: one\n'
+        '{% if r_base == "3.5.1" %}\n'
+        'build:\n'
+        '  skip: True  # [py27 or np<115]\n'
+        '{% endif %}\n')
+    context = lint_functions.LintContext(str(tmpdir))
+    assert {'python', 'numpy', 'r_base'} <= context.variables
+
+
+def test_stream_reporter():
+    stream = io.StringIO()
+    reporter = linting.StreamReporter(stream, 'jsonl')
+    reporter.start([lint_functions.in_other_channels, lint_functions.missing_home])
+    reporter.add('recipes/one', [
+        {'recipe': 'recipes/one', 'check': 'missing_home',
+         'info': {'missing_home': True}}])
+    assert stream.getvalue().count('\n') == 1
+    reporter.add('recipes/one', [
+        {'recipe': 'recipes/one', 'check': 'in_other_channels',
+         'info': {'exists_in_channels': {'conda-forge'}}}])
+    rows = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert rows[1]['info'] == {'exists_in_channels': ['conda-forge']}
+    assert list(reporter.summary().loc['recipes/one', 'failed_tests']) == [
+        'in_other_channels', 'missing_home']
+    assert reporter.report() is None
+
+
+def test_lint_profile(tmpdir):
+    profile = linting.LintProfile()
+    with profile.time('lint', 'missing_home'):
+        pass
+    profile.merge({('lint', 'missing_home'): [2, 1.0],
+                   ('render', 'recipes/one'): [1, 2.0]})
+    rows = profile.rows()
+    assert [row['name'] for row in rows] == ['recipes/one', 'missing_home']
+    assert rows[1]['calls'] == 3
+    assert 'Slowest in render' in profile.summary()
+
+    dump = str(tmpdir.join('profile.json'))
+    profile.dump(dump)
+    with open(dump) as fin:
+        assert json.load(fin) == rows
+
+
+def test_recipe_watcher(tmpdir):
+    r = Recipes(
+        '''
+        one:
+          meta.yaml: |
+            package:
+              name: one
+              version: "0.1"
+        two:
+          meta.yaml: |
+            package:
+              name: two
+              version: "0.1"
+        ''', from_string=True)
+    r.write_recipes()
+    watcher = linting.RecipeWatcher(r.basedir)
+    assert watcher.poll() == []
+
+    with open(os.path.join(r.recipe_dirs['two'], 'build.sh'), 'w') as fout:
+        fout.write('make install\n')
+    assert watcher.poll() == [r.recipe_dirs['two']]
+    assert watcher.poll() == []
+
+    # files edited in place don't change the mtime of the directory
+    with open(os.path.join(r.recipe_dirs['two'], 'build.sh'), 'a') as fout:
+        fout.write('make test\n')
+    assert watcher.poll() == [r.recipe_dirs['two']]
+
+    with open(os.path.join(r.recipe_dirs['one'], 'meta.yaml'), 'a') as fout:
+        fout.write('build:\n  number: 1\n')
+    assert watcher.poll() == [r.recipe_dirs['one']]
+
+    # new recipes are picked up, also if the directory was created first
+    three = os.path.join(r.basedir, 'three')
+    os.mkdir(three)
+    assert watcher.poll() == []
+    with open(os.path.join(three, 'meta.yaml'), 'w') as fout:
+        fout.write('package:\n  name: three\n  version: "0.1"\n')
+    assert watcher.poll() == [three]
+    assert watcher.poll() == []
@@ -1,4 +1,7 @@
+import io
 import sys
+import tarfile
+import zipfile
 from textwrap import dedent
 import subprocess as sp
 
@@ -46,6 +49,29 @@ one:
 """)
 
 
+META_WITH_TESTS = dedent("""
+    package:
+      name: one
+      version: 0.1
+    requirements:
+      run:
+        - python
+    test:
+      commands:
+        - one --help
+      imports:
+        - one
+""")
+
+
+def _info_tar(fileobj, mode):
+    with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+        data = META_WITH_TESTS.encode()
+        info = tarfile.TarInfo('info/recipe/meta.yaml')
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+
 # Skip mulled_test on default since we already run pkg_test.test_package for every test case.
 def _build_pkg(recipe, mulled_test=False):
     r = Recipes(recipe, from_string=True)
@@ -84,6 +110,20 @@ def test_pkg_test_mulled_build_error():
             pkg_test.test_package(pkg, mulled_args='--wrong-arg')
 
 
+@pytest.mark.skipif(SKIP_OSX, reason='skipping on osx')
+def test_pkg_test_batch():
+    """
+    Testing several packages at once reports results per package.
+    """
+    built_packages = _build_pkg(RECIPE_ONE)
+    results = pkg_test.test_packages(built_packages)
+    assert results == {pkg: None for pkg in built_packages}
+
+    results = pkg_test.test_packages(built_packages, mulled_args='--wrong-arg')
+    assert set(results) == set(built_packages)
+    assert all(isinstance(e, sp.CalledProcessError) for e in results.values())
+
+
 @pytest.mark.skipif(SKIP_OSX, reason='skipping on osx')
 def test_pkg_test_custom_base_image():
     """
@@ -121,3 +161,41 @@ def test_pkg_test_conda_image():
     built_packages = _build_pkg(recipe)
     for pkg in built_packages:
         pkg_test.test_package(pkg, conda_image="continuumio/miniconda3:4.3.11")
+
+
+def test_get_tests_tar_bz2(tmpdir):
+    path = str(tmpdir.join('one-0.1-0.tar.bz2'))
+    with open(path, 'wb') as fout:
+        _info_tar(fout, 'w:bz2')
+    tests = pkg_test.get_tests(path)
+    assert tests == 'one --help && python -c "import one"'
+
+
+def test_get_tests_conda(tmpdir):
+    zstandard = pytest.importorskip('zstandard')
+    buf = io.BytesIO()
+    _info_tar(buf, 'w')
+    path = str(tmpdir.join('one-0.1-0.conda'))
+    with zipfile.ZipFile(path, 'w') as pkg_zip:
+        pkg_zip.writestr('info-one-0.1-0.tar.zst',
+                         zstandard.ZstdCompressor().compress(buf.getvalue()))
+    tests = pkg_test.get_tests(path)
+    assert tests == 'one --help && python -c "import one"'
+
+
+def test_iter_package_info_stops_after_info(tmpdir):
+    path = str(tmpdir.join('one-0.1-0.tar.bz2'))
+    with tarfile.open(path, 'w:bz2') as tar:
+        for name in ('info/index.json', 'bin/one', 'info/not-reached'):
+            info = tarfile.TarInfo(name)
+            info.size = len(name)
+            tar.addfile(info, io.BytesIO(name.encode()))
+    assert list(utils.iter_package_info(path)) == [('info/index.json', b'info/index.json')]
+
+
+def test_get_image_name():
+    for ext in ('.tar.bz2', '.conda'):
+        path = '/conda-bld/linux-64/one-two-0.1-py36_0' + ext
+        assert pkg_test.get_image_name(path) == 'one-two=0.1--py36_0'
+    with pytest.raises(ValueError):
+        pkg_test.get_image_name('one-0.1-0.zip')
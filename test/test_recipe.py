@@ -0,0 +1,45 @@
+import pickle
+from textwrap import dedent
+
+from bioconda_utils.recipe import Recipe, parse_compact
+
+
+RECIPE = dedent("""
+    {% set version = "1.10" %}
+    package:
+      name: foo
+      version: {{ version }}
+    source:
+      url: http://example.org/foo-{{ version }}.tar.gz  # upstream
+      sha256: 0123456789
+    build:
+      number: 2
+    requirements:
+      host:
+        - python
+    extra:
+      recipe-maintainers: someone
+""")
+
+
+def test_parse_compact(tmpdir):
+    folder = str(tmpdir)
+    recipe_dir = str(tmpdir.join('foo'))
+
+    expected = Recipe(recipe_dir, folder).load_from_string(RECIPE)
+    compact = pickle.loads(pickle.dumps(parse_compact(recipe_dir, folder, RECIPE)))
+    recipe = Recipe(recipe_dir, folder).load_from_compact(RECIPE, compact)
+
+    assert recipe.meta == expected.meta
+    assert recipe.version == "1.10"
+    assert recipe.meta['extra']['recipe-maintainers'] == ['someone']
+    assert recipe.meta_yaml == expected.meta_yaml
+    assert recipe.meta['build'].lc.key('number') == expected.meta['build'].lc.key('number')
+    assert recipe.meta['requirements']['host'].lc.key(0) == \
+        expected.meta['requirements']['host'].lc.key(0)
+
+    # line information allows editing as before
+    recipe.reset_buildnumber()
+    expected.reset_buildnumber()
+    assert recipe.dump() == expected.dump()
+    assert "number: 0" in recipe.dump()
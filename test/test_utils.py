@@ -1,5 +1,6 @@
 import os
 import sys
+import json
 import subprocess as sp
 import pytest
 import yaml
@@ -7,16 +8,21 @@ import tempfile
 import requests
 import uuid
 import contextlib
+import collections
 import tarfile
+import gzip
 import logging
 import shutil
 from textwrap import dedent
 
 from bioconda_utils import utils
+from bioconda_utils import cli
 from bioconda_utils import pkg_test
 from bioconda_utils import docker_utils
 from bioconda_utils import build
 from bioconda_utils import upload
+from bioconda_utils import linting
+from bioconda_utils import lint_functions
 from helpers import ensure_missing, Recipes
 
 # TODO: need channel order tests. Could probably do this by adding different
@@ -194,6 +200,74 @@ def test_upload(single_upload):
             universal_newlines=True)
 
 
+def test_upload_manager_retries(monkeypatch):
+    attempts = collections.Counter()
+
+    def fake_upload(package, token=None, label=None):
+        attempts[package] += 1
+        if package == 'broken' or attempts[package] == 1:
+            raise sp.CalledProcessError(1, ['anaconda', 'upload', package])
+        return True
+
+    monkeypatch.setattr(upload, 'anaconda_upload', fake_upload)
+    with upload.UploadManager(max_tries=2) as uploader:
+        for pkg in ('one', 'two', 'broken'):
+            uploader.upload_package(pkg)
+        assert uploader.wait() == ['broken']
+    assert attempts == {'one': 2, 'two': 2, 'broken': 2}
+
+
+@pytest.mark.parametrize('body,md5', [
+    ('{"md5": "abc"}', 'abc'),
+    ('<html>maintenance</html>', None),
+    ('["abc"]', None),
+])
+def test_remote_md5(monkeypatch, body, md5):
+    class Response:
+        status_code = 200
+
+        def json(self):
+            return json.loads(body)
+
+    def iter_package_info(package, names=None):
+        yield 'info/index.json', b'{"name": "one", "version": "0.1"}'
+
+    monkeypatch.setattr(utils, 'iter_package_info', iter_package_info)
+    monkeypatch.setattr(requests, 'get', lambda url, timeout=None: Response())
+    assert upload.remote_md5('linux-64/one-0.1-0.tar.bz2', 'bioconda') == md5
+
+
+def test_duplicates_remove_missing_format(monkeypatch):
+    class RepoData:
+        @classmethod
+        def register_config(cls, config):
+            pass
+
+        def get_package_data(self, key, channels=None):
+            return [('one', '0.1', '0')]
+
+    failed = []
+    run = utils.run
+
+    def failing_run(cmds, **kwargs):
+        try:
+            return run(cmds, **kwargs)
+        except sp.CalledProcessError as e:
+            failed.append(e.cmd)
+            raise
+
+    monkeypatch.setattr(utils, 'RepoData', RepoData)
+    monkeypatch.setattr(utils, 'run', failing_run)
+    # every removal fails, as it does for formats that were never uploaded
+    monkeypatch.setattr(utils, 'bin_for', lambda name: 'false')
+    monkeypatch.setenv('ANACONDA_TOKEN', 'secret-token')
+    cli.duplicates({'channels': ['bioconda', 'conda-forge']},
+                   strict_build=True, remove=True)
+    assert [cmd[-1] for cmd in failed] == [
+        'bioconda/one/0.1/one-0.1-0' + ext for ext in utils.PACKAGE_EXTENSIONS]
+    assert all('secret-token' not in cmd for cmd in failed)
+
+
 def test_single_build_only(single_build):
     for pkg in single_build:
         assert os.path.exists(pkg)
@@ -611,6 +685,32 @@ def test_sandboxed():
         assert 'BUILDKITE_TOKEN' not in os.environ
 
 
+def test_run_stream(tmpdir):
+    logfile = str(tmpdir.join('seq.log.gz'))
+    p = utils.run(['seq', '1', '5000'], mask=False, stream=True,
+                  logfile=logfile, tail=10)
+    assert p.stdout.splitlines() == [str(i) for i in range(4991, 5001)]
+    with gzip.open(logfile, 'rt') as log:
+        assert len(log.read().splitlines()) == 5000
+
+
+def test_run_stream_failure_masked(tmpdir):
+    logfile = str(tmpdir.join('fail.log.gz'))
+    with pytest.raises(sp.CalledProcessError) as excinfo:
+        utils.run(['sh', '-c', 'echo secret-token; exit 1'],
+                  mask=['secret-token'], stream=True, logfile=logfile)
+    assert excinfo.value.stdout == 'secret-token\n'
+    with gzip.open(logfile, 'rt') as log:
+        assert log.read() == '<hidden>\n'
+
+
+def test_run_stream_unmasked_hidden(tmpdir):
+    logfile = str(tmpdir.join('hidden.log.gz'))
+    utils.run(['seq', '1', '10'], stream=True, logfile=logfile)
+    with gzip.open(logfile, 'rt') as log:
+        assert log.read() == '<hidden>\n'
+
+
 def test_env_sandboxing():
     r = Recipes(
         """
@@ -703,6 +803,45 @@ def test_skip_dependencies(config_fixture):
             ensure_missing(pkg)
 
 
+def test_lint_failure_skips_dependencies(config_fixture):
+    r = Recipes(
+        """
+        one:
+          meta.yaml: |
+            package:
+              name: lint_skip_dependencies_one
+              version: 0.1
+        two:
+          meta.yaml: |
+            package:
+              name: lint_skip_dependencies_two
+              version: 0.1
+            about:
+              home: https://bioconda.github.io
+            requirements:
+              run:
+                - lint_skip_dependencies_one
+    """, from_string=True)
+    r.write_recipes()
+    pkgs = {}
+    for k, v in r.recipe_dirs.items():
+        pkgs[k] = utils.built_package_paths(v)
+        for pkg in pkgs[k]:
+            ensure_missing(pkg)
+
+    lint_args = linting.LintArgs(registry=[lint_functions.missing_home])
+    build_result = build.build_recipes(
+        r.basedir,
+        config=config_fixture,
+        packages="*",
+        mulled_test=False,
+        lint_args=lint_args,
+    )
+    assert not build_result
+    for pkg in pkgs['one'] + pkgs['two']:
+        assert not os.path.exists(pkg)
+
+
 class TestSubdags(object):
     def _build(self, recipes_fixture, config_fixture):
         build.build_recipes(recipes_fixture.basedir, config=config_fixture, mulled_test=False)